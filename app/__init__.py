@@ -1,7 +1,12 @@
+from threading import BoundedSemaphore
 from flask import Flask
 from flask_login import LoginManager
+from sqlalchemy.exc import SQLAlchemyError
+from .cache import InvalidationListener, TTLCache
 from .config import Config
 from .db import DB
+from .models.balance_ledger import LedgerCompactor
+from .models.inventory_holds import HoldSweeper
 
 login = LoginManager()
 login.login_view = 'users.login'
@@ -12,6 +17,24 @@ def create_app():
     app.config.from_object(Config)
 
     app.db = DB(app)
+    try:
+        app.db.warmup(app.config['DB_POOL_WARMUP'])
+    except SQLAlchemyError as e:
+        app.logger.warning(f"Could not warm up database connection pools: {str(e)}")
+    # One slot per connection of the export pool (see app/export.py)
+    app.export_slots = BoundedSemaphore(app.config['DB_POOLS']['export']['pool_size'])
+    app.cache = TTLCache(app.config['CACHE_TTL'], app.config['CACHE_MAX_ENTRIES'])
+    if app.config['CACHE_INVALIDATION_CHANNEL']:
+        app.cache_listener = InvalidationListener(
+            app.db, app.cache, app.config['CACHE_INVALIDATION_CHANNEL'],
+            app.config['CACHE_LISTENER_HEARTBEAT'], app.logger)
+        app.cache_listener.start()
+    if app.config['INVENTORY_HOLD_SWEEP_INTERVAL'] > 0:
+        app.hold_sweeper = HoldSweeper(app, app.config['INVENTORY_HOLD_SWEEP_INTERVAL'])
+        app.hold_sweeper.start()
+    if app.config['LEDGER_COMPACT_INTERVAL'] > 0:
+        app.ledger_compactor = LedgerCompactor(app, app.config['LEDGER_COMPACT_INTERVAL'])
+        app.ledger_compactor.start()
     login.init_app(app)
 
     # Imports must happen after app is created to avoid circular imports
@@ -0,0 +1,216 @@
+import json
+import random
+import select
+import time
+from collections import Counter, OrderedDict
+from threading import Event, Lock, Thread
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    A thread-safe, in-process cache whose entries expire ttl seconds after
+    they were set. It holds at most max_size entries and evicts the least
+    recently used one to make room.
+
+    Keys are tuples whose first element is a tag naming the data the value
+    was computed from, e.g. ('orders', user_id). Writers call
+    invalidate(tag) after changing that data, so readers do not have to wait
+    for the entries to expire. Hits, misses, evictions and invalidations
+    are counted per kind of tag (its first element, for tuple tags); see
+    stats().
+    """
+
+    def __init__(self, ttl, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._keys_by_tag = {}
+        self._stats = Counter()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._stats[(_kind(key[0]), 'misses')] += 1
+                return default
+            self._entries.move_to_end(key)
+            entry[2] += 1
+            self._stats[(_kind(key[0]), 'hits')] += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while len(self._entries) >= self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats[(_kind(oldest[0]), 'evictions')] += 1
+            self._entries[key] = [value, expires, 0]
+            self._keys_by_tag.setdefault(key[0], set()).add(key)
+
+    def get_or_set(self, key, compute, ttl=None):
+        """Returns the cached value of key, calling compute() to fill it in on a miss."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, tag):
+        """Drops every entry whose key starts with tag."""
+        with self._lock:
+            keys = self._keys_by_tag.get(tag, ())
+            self._stats[(_kind(tag), 'invalidations')] += len(keys)
+            for key in list(keys):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_tag.clear()
+
+    def stats(self):
+        """Returns {kind: {'hits': .., 'misses': .., ...}} plus the current size,
+        and the hit counts of the most used entries."""
+        with self._lock:
+            by_kind = {}
+            for (kind, name), count in self._stats.items():
+                by_kind.setdefault(kind, Counter())[name] = count
+            hottest = sorted(self._entries.items(), key=lambda item: item[1][2], reverse=True)[:10]
+            return {
+                'size': len(self._entries),
+                'kinds': {kind: dict(counts) for kind, counts in by_kind.items()},
+                'hottest': [(key, entry[2]) for key, entry in hottest],
+            }
+
+    def _remove(self, key):
+        del self._entries[key]
+        keys = self._keys_by_tag.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_tag[key[0]]
+
+
+def _kind(tag):
+    return tag[0] if isinstance(tag, tuple) else tag
+
+
+def encode_tags(tags, max_bytes=7000):
+    """
+    Packs tags into JSON NOTIFY payloads of at most max_bytes each (Postgres
+    rejects payloads of 8000 bytes or more). Tuples travel as JSON arrays.
+    """
+    payloads = []
+    chunk = []
+    size = 2
+    for tag in tags:
+        encoded = json.dumps(tag, separators=(',', ':'))
+        if chunk and size + len(encoded) + 1 > max_bytes:
+            payloads.append('[' + ','.join(chunk) + ']')
+            chunk = []
+            size = 2
+        chunk.append(encoded)
+        size += len(encoded) + 1
+    if chunk:
+        payloads.append('[' + ','.join(chunk) + ']')
+    return payloads
+
+
+def decode_tags(payload):
+    """Unpacks a payload made by encode_tags() back into a list of tags."""
+    return [_to_tag(tag) for tag in json.loads(payload)]
+
+
+def _to_tag(value):
+    return tuple(_to_tag(v) for v in value) if isinstance(value, list) else value
+
+
+class InvalidationListener(Thread):
+    """
+    Keeps a process's cache in step with writes made by other processes.
+
+    invalidate() (app/models/helpers/cache.py) NOTIFYs the tags it drops on
+    a Postgres channel, as part of the writing transaction, so the
+    notification is only delivered if the write commits. This thread LISTENs
+    on that channel on a connection of its own and drops the same tags from
+    the local cache. Notifications sent while it is disconnected are lost,
+    so after reconnecting it flushes the whole cache; a heartbeat query every
+    timeout seconds notices a dead connection.
+    """
+
+    def __init__(self, db, cache, channel, timeout, logger):
+        super().__init__(name='cache-invalidation-listener', daemon=True)
+        self.db = db
+        self.cache = cache
+        self.channel = channel
+        self.timeout = timeout
+        self.logger = logger
+        self._stopped = Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        delay = 0
+        gap = False
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                if gap:
+                    self.cache.clear()
+                    self.logger.info("Cache invalidation listener reconnected; flushed the cache")
+                    gap = False
+                delay = 0
+                self._listen(conn)
+            except Exception as e:
+                if not gap:
+                    self.logger.warning(f"Cache invalidation listener disconnected: {str(e)}")
+                gap = True
+                self.cache.clear()
+                delay = min(max(delay * 2, 0.5), 30)
+                self._stopped.wait(random.uniform(delay / 2, delay))
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _connect(self):
+        # A pool connection detached for good, so it does not hold a pool slot
+        fairy = self.db.engine.raw_connection()
+        conn = fairy.dbapi_connection
+        fairy.detach()
+        conn.rollback()
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return conn
+
+    def _listen(self, conn):
+        while not self._stopped.is_set():
+            if select.select([conn], [], [], self.timeout) == ([], [], []):
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            else:
+                conn.poll()
+            while conn.notifies:
+                payload = conn.notifies.pop(0).payload
+                try:
+                    tags = decode_tags(payload)
+                except (ValueError, TypeError):
+                    self.logger.warning(f"Malformed cache invalidation payload; flushing the cache: {payload[:100]}")
+                    self.cache.clear()
+                    continue
+                for tag in tags:
+                    self.cache.invalidate(tag)
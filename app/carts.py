@@ -4,6 +4,7 @@ from app.models.cart_items import CartItems
 from app.models.cart_submission import CartSubmission
 from app.models.coupons import Coupons
 from decimal import Decimal
+import uuid
 
 bp = Blueprint('carts', __name__)
 
@@ -39,7 +40,8 @@ def view_cart():
         discount_amount=discount_amount,
         coupon_code=coupon_code,
         page=page,
-        total_pages=total_pages
+        total_pages=total_pages,
+        idempotency_key=uuid.uuid4().hex
     )
 
 @bp.route('/add_to_cart', methods=['POST'])
@@ -87,7 +89,9 @@ def remove_item():
 @bp.route('/submit_cart', methods=['POST'])
 @login_required
 def submit_cart():
-    result = CartSubmission.submit_cart(current_user.id)
+    # Set by the cart page (or an API client), so resubmissions are not checked out twice
+    idempotency_key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    result = CartSubmission.submit_cart(current_user.id, (idempotency_key or '')[:64] or None)
     if result == "Purchase successful!":
         flash("Your purchase was completed successfully!")
     else:
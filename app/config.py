@@ -11,3 +11,81 @@ class Config(object):
                 os.environ.get('DB_PORT'),
                 os.environ.get('DB_NAME'))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pool settings, used for the default pool and as the
+    # defaults of every named pool below (which may also set isolation_level)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'True') == 'True'
+    # Connections opened per pool by create_app() before serving requests
+    DB_POOL_WARMUP = int(os.environ.get('DB_POOL_WARMUP', 2))
+
+    # Named pools that model methods select with @use_pool, so that slow
+    # analytic queries cannot exhaust the connections checkout needs
+    DB_POOLS = {
+        # Cart and checkout writes lock the rows they check (see
+        # app/models/inventory_holds.py), so they run at READ COMMITTED and
+        # queue on those locks instead of aborting with serialization failures
+        'checkout': {
+            'pool_size': int(os.environ.get('DB_CHECKOUT_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_CHECKOUT_MAX_OVERFLOW', 5)),
+            'isolation_level': os.environ.get('DB_CHECKOUT_ISOLATION_LEVEL', 'READ COMMITTED'),
+        },
+        'catalog': {
+            'pool_size': int(os.environ.get('DB_CATALOG_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_CATALOG_MAX_OVERFLOW', 5)),
+        },
+        'analytics': {
+            'pool_size': int(os.environ.get('DB_ANALYTICS_POOL_SIZE', 2)),
+            'max_overflow': int(os.environ.get('DB_ANALYTICS_MAX_OVERFLOW', 1)),
+            'pool_timeout': int(os.environ.get('DB_ANALYTICS_POOL_TIMEOUT', 5)),
+        },
+        # Order history downloads hold a connection for as long as the client
+        # takes to read them; at most pool_size run at once (see app/export.py)
+        'export': {
+            'pool_size': int(os.environ.get('DB_EXPORT_POOL_SIZE', 2)),
+            'max_overflow': 0,
+        },
+    }
+
+    # Re-runs of a unit of work that aborted on a serialization failure or
+    # deadlock (see app/models/helpers/db_exceptions_wrapper.py)
+    DB_RETRY_ATTEMPTS = int(os.environ.get('DB_RETRY_ATTEMPTS', 8))
+    DB_RETRY_BASE_DELAY = float(os.environ.get('DB_RETRY_BASE_DELAY', 0.02))
+    DB_RETRY_MAX_DELAY = float(os.environ.get('DB_RETRY_MAX_DELAY', 1.0))
+
+    # Statement instrumentation (see app/query_stats.py)
+    DB_SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', 200))
+    DB_N_PLUS_ONE_THRESHOLD = int(os.environ.get('DB_N_PLUS_ONE_THRESHOLD', 10))
+    DB_QUERY_STATS_HEADER = os.environ.get('DB_QUERY_STATS_HEADER', 'False') == 'True'
+
+    # In-process read cache of catalog data (see app/cache.py and
+    # app/models/helpers/cache.py); entries are also dropped on writes
+    CACHE_TTL = float(os.environ.get('CACHE_TTL', 300))
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+    # Postgres channel that carries invalidations between worker processes
+    # (empty to disable), and how often its listener checks its connection
+    CACHE_INVALIDATION_CHANNEL = os.environ.get('CACHE_INVALIDATION_CHANNEL', 'cache_invalidation')
+    CACHE_LISTENER_HEARTBEAT = float(os.environ.get('CACHE_LISTENER_HEARTBEAT', 5))
+    # Lifetime of cached listing counts (see app/models/helpers/pagination.py)
+    COUNT_CACHE_TTL = float(os.environ.get('COUNT_CACHE_TTL', 60))
+
+    # Inventory holds taken by carts (see app/models/inventory_holds.py): how
+    # long a hold lasts, and how often expired ones are deleted (0 to disable)
+    INVENTORY_HOLD_TTL = float(os.environ.get('INVENTORY_HOLD_TTL', 900))
+    INVENTORY_HOLD_SWEEP_INTERVAL = float(os.environ.get('INVENTORY_HOLD_SWEEP_INTERVAL', 60))
+
+    # Job queue run by worker.py (see app/jobs.py): how long a claimed job is
+    # leased to its worker, how often an idle worker polls, and the retries of
+    # failed jobs (with exponential backoff) before they are marked dead
+    JOB_LEASE = float(os.environ.get('JOB_LEASE', 300))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+    JOB_RETRY_BASE_DELAY = float(os.environ.get('JOB_RETRY_BASE_DELAY', 2))
+    JOB_RETRY_MAX_DELAY = float(os.environ.get('JOB_RETRY_MAX_DELAY', 600))
+
+    # How often the balance ledger is folded into Users.balance (0 to disable;
+    # see app/models/balance_ledger.py)
+    LEDGER_COMPACT_INTERVAL = float(os.environ.get('LEDGER_COMPACT_INTERVAL', 30))
@@ -1,14 +1,29 @@
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from threading import Lock
+from flask import g, has_app_context, has_request_context, request
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, scoped_session
+from .query_stats import QueryStats, fingerprint, redact
 
 class DB:
     """Hosts all functions for querying the database.
 
-    Use the execute() method if you want to execute a single SQL
-    statement (which will be in a transaction by itself.
+    Inside a Flask request, every execute() call runs on one connection
+    and in one transaction (the request's unit of work).  The connection
+    is checked out of the pool lazily by the first execute() of the
+    request, committed after the view returns, and rolled back if the
+    request fails.  Call commit() or rollback() to end the unit of work
+    early; the next execute() starts a new transaction on the same
+    connection.  A statement that raises rolls the whole unit of work
+    back before the exception propagates.
 
-    If you want to execute multiple SQL statements in the same
-    transaction, use the following pattern:
+    Outside of a request (scripts, the shell), execute() runs each
+    statement in a transaction by itself, as before.  If you want to
+    execute multiple SQL statements in the same transaction there, use
+    the following pattern:
 
     >>> with app.db.engine.begin() as conn:
     >>>     # everything in this block executes as one transaction
@@ -17,11 +32,34 @@ class DB:
     >>>     conn.execute(text('UPDATE...'), par=value)
     >>>
 
+    Besides the default pool, the app keeps one pool per entry of
+    Config.DB_POOLS.  Statements run inside ``with app.db.use_pool(name)``
+    (or a model method decorated with @use_pool(name)) use that pool, so
+    one kind of workload cannot take all of the connections.  Transactions
+    are SERIALIZABLE unless the pool sets another isolation_level.
+
+    Every statement is timed.  Statements slower than DB_SLOW_QUERY_MS are
+    logged with their parameters, a statement repeated DB_N_PLUS_ONE_THRESHOLD
+    times within one request is logged as a likely N+1 query, and a summary
+    of each request's statements is logged at debug level (and sent in the
+    X-DB-Queries response header when DB_QUERY_STATS_HEADER is set or the
+    app runs in debug mode).
+
     """
     def __init__(self, app):
-        self.engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'],
-                                    execution_options={"isolation_level": "SERIALIZABLE"})
+        self.engine = self._create_engine(app.config)
+        self.engines = {'default': self.engine}
+        for name, options in app.config.get('DB_POOLS', {}).items():
+            self.engines[name] = self._create_engine(app.config, **options)
         self.Session = scoped_session(sessionmaker(bind=self.engine))
+        self.stats = Counter()
+        self._stats_lock = Lock()
+        self.logger = app.logger
+        self.slow_query_ms = app.config['DB_SLOW_QUERY_MS']
+        self.n_plus_one_threshold = app.config['DB_N_PLUS_ONE_THRESHOLD']
+        self.stats_header = app.config['DB_QUERY_STATS_HEADER'] or app.debug
+        app.after_request(self._commit_request)
+        app.teardown_request(self._teardown_request)
 
     def execute(self, sqlstr, **kwargs):
         """Execute a single SQL statement sqlstr.
@@ -39,19 +77,260 @@ class DB:
         for additional details.  See models/*.py for examples of
         calling this function.
         """
-        with self.engine.begin() as conn:
-            result = conn.execute(text(sqlstr), kwargs)
-            if result.returns_rows:
-                return result.fetchall()
-            else:
-                return result.rowcount
+        return self._execute(sqlstr, kwargs)
+
+    def execute_many(self, sqlstr, rows, page_size=500, **kwargs):
+        """Execute sqlstr for many rows of parameters in one round trip per
+        page_size rows, in the manner of psycopg2's execute_values().
+        sqlstr must contain a single :values placeholder, which is replaced
+        by a multi-row VALUES list built from rows (a sequence of tuples,
+        each in the column order the statement expects):
+
+        >>> app.db.execute_many('INSERT INTO T (a, b) VALUES :values',
+        >>>                     [(1, 'x'), (2, 'y')])
+        >>> app.db.execute_many('UPDATE T SET b = v.b '
+        >>>                     'FROM (VALUES :values) AS v(a, b) '
+        >>>                     'WHERE T.a = v.a', [(1, 'x'), (2, 'y')])
+
+        Other :name parameters of the statement are bound from kwargs, as
+        in execute().  An UPDATE ... FROM applies at most one VALUES row to
+        each target row, so aggregate duplicates before calling.  The
+        statements join the current unit of work like execute().  Returns
+        the result tuples of all pages if the statement has a RETURNING
+        clause, the total row count otherwise.
+        """
+        returning = re.search(r'\bRETURNING\b', sqlstr, re.IGNORECASE) is not None
+        results = [] if returning else 0
+        for start in range(0, len(rows), page_size):
+            params = dict(kwargs)
+            tuples = []
+            for i, row in enumerate(rows[start:start + page_size]):
+                names = [f'v{i}_{j}' for j in range(len(row))]
+                params.update(zip(names, row))
+                tuples.append('(' + ', '.join(':' + name for name in names) + ')')
+            results += self._execute(sqlstr.replace(':values', ', '.join(tuples)), params)
+        return results
+
+    def stream(self, sqlstr, batch_size=1000, batches=False, **kwargs):
+        """Iterate over the result tuples of query sqlstr without holding
+        the whole result in memory: rows are fetched batch_size at a time
+        through a server-side (named) cursor.  With batches=True, lists of
+        up to batch_size rows are yielded instead of single rows.
+
+        >>> for row in app.db.stream('SELECT ... FROM CartProducts', batch_size=5000):
+        >>>     writer.writerow(row)
+
+        The query runs on its own connection from the current pool, in a
+        READ ONLY DEFERRABLE transaction, so a long export neither sees a
+        changing snapshot nor makes concurrent writers abort.  The cursor
+        and connection are released when the iteration finishes or the
+        generator is closed early (e.g. by a client disconnecting).
+        """
+        # Resolve the pool now; the generator body only runs on first next()
+        return self._stream(self._current_engine(), sqlstr, batch_size, batches, kwargs)
+
+    def _stream(self, engine, sqlstr, batch_size, batches, params):
+        elapsed = 0.0
+        count = 0
+        with engine.connect() as conn:
+            try:
+                with conn.begin():
+                    conn.exec_driver_sql('SET TRANSACTION READ ONLY DEFERRABLE')
+                    start = time.perf_counter()
+                    result = conn.execution_options(stream_results=True, max_row_buffer=batch_size)\
+                        .execute(text(sqlstr), params)
+                    partitions = result.partitions(batch_size)
+                    elapsed += time.perf_counter() - start
+                    while True:
+                        start = time.perf_counter()
+                        batch = next(partitions, None)
+                        elapsed += time.perf_counter() - start
+                        if batch is None:
+                            break
+                        count += len(batch)
+                        if batches:
+                            yield batch
+                        else:
+                            yield from batch
+            finally:
+                self._record(sqlstr, params, elapsed, count)
+
+    def _execute(self, sqlstr, params):
+        conn = self._unit_of_work()
+        if conn is None:
+            with self._current_engine().begin() as conn:
+                return self._run(conn, sqlstr, params)
+        try:
+            return self._run(conn, sqlstr, params)
+        except Exception:
+            self.rollback()
+            raise
+
+    def _run(self, conn, sqlstr, params):
+        start = time.perf_counter()
+        result = conn.execute(text(sqlstr), params)
+        if result.returns_rows:
+            rows = result.fetchall()
+            self._record(sqlstr, params, time.perf_counter() - start, len(rows))
+            return rows
+        else:
+            self._record(sqlstr, params, time.perf_counter() - start, result.rowcount)
+            return result.rowcount
+
+    def _record(self, sqlstr, params, duration, rows):
+        if duration * 1000 >= self.slow_query_ms:
+            self.logger.warning(f"Slow query ({duration * 1000:.1f} ms, {rows} rows): "
+                                f"{fingerprint(sqlstr)} params={redact(params)}")
+        if not has_request_context():
+            return
+        query_stats = g.get('_db_query_stats')
+        if query_stats is None:
+            query_stats = g._db_query_stats = QueryStats()
+        if query_stats.record(sqlstr, duration, rows) == self.n_plus_one_threshold:
+            self.logger.warning(f"Possible N+1 query in {request.endpoint}: ran "
+                                f"{self.n_plus_one_threshold} times: {fingerprint(sqlstr)}")
+
+    @staticmethod
+    def _create_engine(config, **options):
+        return create_engine(
+            config['SQLALCHEMY_DATABASE_URI'],
+            pool_size=options.get('pool_size', config['DB_POOL_SIZE']),
+            max_overflow=options.get('max_overflow', config['DB_MAX_OVERFLOW']),
+            pool_timeout=options.get('pool_timeout', config['DB_POOL_TIMEOUT']),
+            pool_recycle=options.get('pool_recycle', config['DB_POOL_RECYCLE']),
+            pool_pre_ping=options.get('pool_pre_ping', config['DB_POOL_PRE_PING']),
+            execution_options={"isolation_level": options.get('isolation_level', 'SERIALIZABLE')})
+
+    @contextmanager
+    def use_pool(self, name):
+        """Runs the statements executed inside the block on the named pool.
+        Unknown names fall back to the default pool.  Each pool has its own
+        connection in the request's unit of work, so keep the writes of one
+        operation on a single pool."""
+        previous = g.get('_db_pool', 'default')
+        g._db_pool = name if name in self.engines else 'default'
+        try:
+            yield
+        finally:
+            g._db_pool = previous
+
+    def _current_pool(self):
+        return g.get('_db_pool', 'default') if has_app_context() else 'default'
+
+    def _current_engine(self):
+        return self.engines[self._current_pool()]
+
+    def warmup(self, connections):
+        """Opens up to `connections` connections in every pool (bounded by
+        the pool size) and returns them, so the first requests after
+        startup do not pay for connection setup."""
+        for engine in self.engines.values():
+            opened = []
+            try:
+                for _ in range(min(connections, engine.pool.size())):
+                    opened.append(engine.connect())
+            finally:
+                for conn in opened:
+                    conn.close()
+
+    @contextmanager
+    def unit_of_work(self):
+        """Scopes a unit of work to the block when there is no request to
+        scope it to (scripts, background threads), so that execute() calls
+        inside it share one transaction per pool.  Inside a request, or an
+        enclosing unit_of_work() block, it does nothing."""
+        if not has_app_context() or has_request_context() or g.get('_db_conns') is not None:
+            yield
+            return
+        g._db_conns = {}
+        try:
+            yield
+        finally:
+            self.rollback()
+            self.remove()
+
+    def after_commit(self, func):
+        """Calls func() once the current unit of work has committed, or not
+        at all if it rolls back.  Outside of a unit of work, where every
+        statement commits by itself, func() is called right away."""
+        if not has_app_context() or (not has_request_context() and g.get('_db_conns') is None):
+            func()
+            return
+        g.setdefault('_db_after_commit', []).append(func)
+
+    def after_rollback(self, func):
+        """Calls func() once the current unit of work has rolled back, or
+        not at all if it commits.  Outside of a unit of work, where every
+        statement commits by itself, func() is never called."""
+        if not has_app_context() or (not has_request_context() and g.get('_db_conns') is None):
+            return
+        g.setdefault('_db_after_rollback', []).append(func)
+
+    def incr(self, name, amount=1):
+        """Bumps the process-wide counter name in self.stats."""
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _unit_of_work(self):
+        """Returns the connection of the current request's unit of work in
+        the current pool, checking one out on first use, or None when there
+        is no request to scope it to."""
+        if not has_app_context():
+            return None
+        conns = g.get('_db_conns')
+        if conns is None:
+            if not has_request_context():
+                return None
+            conns = g._db_conns = {}
+        pool = self._current_pool()
+        conn = conns.get(pool)
+        if conn is None:
+            conn = conns[pool] = self.engines[pool].connect()
+        return conn
+
+    def _open_connections(self):
+        if not has_app_context():
+            return []
+        return list(g.get('_db_conns', {}).values())
 
     def commit(self):
+        for conn in self._open_connections():
+            if conn.in_transaction():
+                conn.commit()
         self.Session.commit()
+        if has_app_context():
+            g.pop('_db_after_rollback', None)
+            for func in g.pop('_db_after_commit', []):
+                func()
 
     def rollback(self):
+        for conn in self._open_connections():
+            # Also clears a transaction left inactive by a failed commit
+            conn.rollback()
         self.Session.rollback()
+        if has_app_context():
+            g.pop('_db_after_commit', None)
+            for func in g.pop('_db_after_rollback', []):
+                func()
 
     def remove(self):
+        for conn in self._open_connections():
+            conn.close()
+        if has_app_context():
+            g.pop('_db_conns', None)
         self.Session.remove()
-            
\ No newline at end of file
+
+    def _commit_request(self, response):
+        # Commit before the response leaves the app so that a failed commit
+        # turns into an error page instead of a success the database lost.
+        self.commit()
+        query_stats = g.get('_db_query_stats') or QueryStats()
+        self.logger.debug(f"{request.method} {request.path}: {query_stats.summary()}")
+        if self.stats_header:
+            response.headers['X-DB-Queries'] = query_stats.summary()
+        return response
+
+    def _teardown_request(self, exc):
+        if exc is not None:
+            self.rollback()
+        self.remove()
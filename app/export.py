@@ -0,0 +1,85 @@
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from flask import Response, current_app, stream_with_context
+
+# Content types of the export formats
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+# Seconds a client turned away because every export slot is taken should wait
+EXPORT_RETRY_AFTER = 30
+
+
+def parse_date_range(args):
+    """
+    Reads the optional start and end dates (YYYY-MM-DD, both inclusive) of an
+    export from the query string. Returns (start, end) as datetimes bounding
+    the range half-open, either of them None if not given; raises ValueError
+    on a malformed date or an empty range.
+    """
+    start = args.get('start') or None
+    end = args.get('end') or None
+    start = datetime.combine(date.fromisoformat(start), datetime.min.time()) if start else None
+    end = datetime.combine(date.fromisoformat(end) + timedelta(days=1), datetime.min.time()) if end else None
+    if start and end and start >= end:
+        raise ValueError("The end date must not be before the start date.")
+    return start, end
+
+
+def export_response(columns, batches, fmt, filename):
+    """
+    Streams batches of result rows (e.g. from app.db.stream(..., batches=True))
+    to the client as a chunked CSV or NDJSON download, one chunk per batch, so
+    the export's memory use is bounded by the batch size however many rows
+    it has. The rows are read as the client downloads them, inside the
+    request's context.
+
+    Each download holds one of the app's export slots, one per connection of
+    the export pool the rows are read on, until the response is closed. When
+    all of them are taken the client gets a 429 right away, rather than a
+    download that fails once the pool times out.
+    """
+    slots = current_app.export_slots
+    if not slots.acquire(blocking=False):
+        batches.close()
+        return Response("Too many exports are running. Please try again shortly.\n", status=429,
+                        mimetype='text/plain', headers={'Retry-After': str(EXPORT_RETRY_AFTER)})
+    if fmt == 'ndjson':
+        chunks = _ndjson(columns, batches)
+    else:
+        fmt = 'csv'
+        chunks = _csv(columns, batches)
+    response = Response(
+        stream_with_context(chunks),
+        mimetype=FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'},
+    )
+    response.call_on_close(slots.release)
+    return response
+
+
+def _csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue()
+
+
+def _ndjson(columns, batches):
+    for batch in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row)), default=_json_value) + '\n'
+                      for row in batch)
+
+
+def _json_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot export a value of type {type(value).__name__}")
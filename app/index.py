@@ -1,15 +1,36 @@
-from flask import Blueprint, render_template, request, flash, current_app
+from flask import Blueprint, render_template, request, flash, current_app, url_for
 from flask_login import login_required, current_user
 import datetime
 from .models.product import Product
 from app.models.helpers.db_exceptions_wrapper import handle_db_exceptions
+from app.models.helpers.db_pool import use_pool
+from app.models.helpers.search import build_tsquery
+from app.models.helpers.pagination import Keyset, encode_cursor, decode_cursor, cached_count, estimated_count
 
 bp = Blueprint('index', __name__)
 
+# Sort modes of the catalog (one row per product), each ending in the product_id tie-breaker
+_TIE_BREAKER = [('o.product_id', 'INT', 'product_id')]
+KEYSETS = {
+    'id': Keyset(_TIE_BREAKER),
+    'price_asc': Keyset([('o.best_price', 'DECIMAL', 'price')] + _TIE_BREAKER),
+    'price_desc': Keyset([('o.best_price', 'DECIMAL', 'price')] + _TIE_BREAKER, descending=True),
+    'rating_high': Keyset([('ps.average_rating', 'DECIMAL', 'average_rating')] + _TIE_BREAKER, descending=True),
+    'rating_low': Keyset([('ps.average_rating', 'DECIMAL', 'average_rating')] + _TIE_BREAKER),
+    'relevance': Keyset([('ts_rank(p.search_vector, to_tsquery(\'english\', :tsquery))', 'REAL', 'rank')]
+                        + _TIE_BREAKER, descending=True),
+}
+
+# Deepest page reachable by number (with OFFSET); further pages are only
+# reachable through the cursors of the Next/Previous links
+MAX_NUMBERED_PAGE = 20
+
 @bp.route('/')
+@use_pool('catalog')
 def index():
     # Get the current page and items per page for pagination
-    page = request.args.get('page', 1, type=int)
+    page = min(max(request.args.get('page', 1, type=int), 1), MAX_NUMBERED_PAGE)
+    cursor = request.args.get('cursor')
     items_per_page = 9
 
     # Get the filter and sort parameters from the request
@@ -19,99 +40,114 @@ def index():
     min_price = request.args.get('min_price', type=float)
     max_price = request.args.get('max_price', type=float)
 
-    # Base query with average rating and review count calculation
-    query = """
-    SELECT p.product_id, p.product_name, p.price, p.available, 
-           p.seller_id, p.product_quantity, p.description, 
-           p.image, p.category, 
-           COALESCE(ROUND(AVG(r.stars), 1), 0) AS average_rating,
-           COUNT(r.review_id) AS num_reviews
-    FROM Products p
-    LEFT JOIN Reviews r ON p.product_id = r.product_id
-    WHERE p.available = TRUE
-    """
+    # Filters shared by the page query and the count query: one row per product
+    # that some seller has in stock, at its lowest price (see ProductOffers)
+    where = "o.best_seller_id IS NOT NULL"
     params = {}
 
-    # Apply price range filter
+    # Apply price range filter (served by the index on the best price)
     if min_price is not None:
-        query += " AND p.price >= :min_price"
+        where += " AND o.best_price >= :min_price"
         params['min_price'] = min_price
     if max_price is not None:
-        query += " AND p.price <= :max_price"
+        where += " AND o.best_price <= :max_price"
         params['max_price'] = max_price
 
-
-    # Apply search filter
-    if search:
-        query += """
-            AND (p.product_name ILIKE :search OR p.description ILIKE :search)
-        """
-        params['search'] = f"%{search}%"
+    # Apply full-text search filter (served by the GIN index on search_vector)
+    tsquery = build_tsquery(search) if search else None
+    if tsquery:
+        where += " AND p.search_vector @@ to_tsquery('english', :tsquery)"
+        params['tsquery'] = tsquery
 
     # Apply category filter
     if category:
-        query += " AND p.category = :category"
+        where += " AND o.category = :category"
         params['category'] = category
 
-    # Group by product ID to calculate average rating and review count
-    query += """
-        GROUP BY p.product_id, p.product_name, p.price, p.available, 
-                 p.seller_id, p.product_quantity, p.description, 
-                 p.image, p.category
+    # Pick the sort mode; best matches first when searching without an explicit sort
+    if sort not in KEYSETS:
+        sort = 'relevance' if tsquery else 'id'
+    elif sort == 'relevance' and not tsquery:
+        sort = 'id'
+    keyset = KEYSETS[sort]
+
+    # Base query: the best offer of each product, with its seller count and the
+    # average rating and review count maintained in ProductStats
+    query = f"""
+    SELECT p.product_id, p.product_name, o.best_price AS price, p.available, 
+           p.seller_id, p.product_quantity, p.description, 
+           p.image, p.category, o.seller_count,
+           ps.average_rating,
+           ps.review_count AS num_reviews
+           {", ts_rank(p.search_vector, to_tsquery('english', :tsquery)) AS rank" if tsquery else ""}
+    FROM ProductOffers o
+    JOIN Products p ON p.product_id = o.product_id AND p.seller_id = o.best_seller_id
+    JOIN ProductStats ps ON ps.product_id = o.product_id
+    WHERE {where}
     """
-
-    # Apply sorting based on request parameter
-    if sort == 'price_asc':
-        query += " ORDER BY p.price ASC"
-    elif sort == 'price_desc':
-        query += " ORDER BY p.price DESC"
-# Future sorting options, such as sorting by rating
-    elif sort == 'rating_high':
-        query += " ORDER BY average_rating DESC"
-    elif sort == 'rating_low':
-        query += " ORDER BY average_rating ASC"
-
-    
-    # Calculate the offset for pagination
-    offset = (page - 1) * items_per_page
-    query += " LIMIT :limit OFFSET :offset"
-    params['limit'] = items_per_page
-    params['offset'] = offset
-
-    # Execute the query to get filtered products
-    filtered_products = current_app.db.execute(query, **params)
-
-    # Get the total count of products for calculating total pages
-    count_query = """
-        SELECT COUNT(*) FROM Products p
-        WHERE p.available = TRUE
+    page_params = dict(params, limit=items_per_page + 1)
+
+    # Seek from the cursor if there is one, otherwise use OFFSET for the (shallow) numbered page
+    position = decode_cursor(cursor, sort, keyset) if cursor else None
+    backwards = False
+    if position:
+        values, page, backwards = position
+        condition, seek_params = keyset.seek(values, backwards)
+        query += f" AND {condition} {keyset.order_by(backwards)} LIMIT :limit"
+        page_params.update(seek_params)
+    else:
+        position = None
+        query += f" {keyset.order_by()} LIMIT :limit OFFSET :offset"
+        page_params['offset'] = (page - 1) * items_per_page
+
+    # Execute the query to get filtered products, plus one row to tell whether there are more
+    filtered_products = current_app.db.execute(query, **page_params)
+    has_more = len(filtered_products) > items_per_page
+    filtered_products = filtered_products[:items_per_page]
+    if backwards:
+        filtered_products.reverse()
+    has_next = has_more if not backwards else True
+    has_prev = has_more if backwards else (page > 1 and bool(filtered_products))
+
+    # Cursors for the Next/Previous links, keeping the current filters
+    args = {k: v for k, v in request.args.items() if k not in ('page', 'cursor')}
+    next_url = prev_url = None
+    if has_next and filtered_products:
+        next_url = url_for('index.index', **args, cursor=encode_cursor(
+            sort, keyset.values(filtered_products[-1]), page + 1))
+    if has_prev:
+        if position:
+            prev_url = url_for('index.index', **args, cursor=encode_cursor(
+                sort, keyset.values(filtered_products[0]), max(page - 1, 1), backwards=True))
+        else:
+            prev_url = url_for('index.index', **args, page=page - 1)
+
+    # Get the total count of products for calculating total pages: the unfiltered
+    # catalog is large, so use the planner's estimate of its rows; filtered counts
+    # are cached until a product changes (see InventoryItems.product_changed)
+    count_from = f"""
+    FROM ProductOffers o
+    {"JOIN Products p ON p.product_id = o.product_id AND p.seller_id = o.best_seller_id" if tsquery else ""}
+    WHERE {where}
     """
-    count_params = {}  # Use a separate params dictionary for count query
-    if search:
-        count_query += """
-            AND (p.product_name ILIKE :search OR p.description ILIKE :search)
-        """
-        count_params['search'] = f"%{search}%"
-    if category:
-        count_query += " AND p.category = :category"
-        count_params['category'] = category
-
-    total_items_result = current_app.db.execute(count_query, **count_params)
-    total_items = total_items_result[0][0]  # Extract count from the result
+    total_estimated = not params
+    if total_estimated:
+        total_items = estimated_count(f"SELECT 1 {count_from}")
+    else:
+        total_items = cached_count('products', f"SELECT COUNT(*) {count_from}", **params)
     total_pages = (total_items + items_per_page - 1) // items_per_page
 
     # Get distinct categories for the dropdown in the UI
-    categories = current_app.db.execute(
-        "SELECT DISTINCT category FROM Products WHERE available = TRUE"
-    )
+    categories = Product.get_categories()
 
     # Render the page with the filtered product items
     return render_template(
         'index.html',
         product_items=filtered_products,
-        categories=[c[0] for c in categories],
+        categories=categories,
         page=page,
-        total_pages=total_pages
+        total_pages=total_pages,
+        total_estimated=total_estimated,
+        next_url=next_url,
+        prev_url=prev_url
     )
-
-
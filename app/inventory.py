@@ -1,7 +1,9 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app
 from flask_login import login_required, current_user
-from app.models.orders import Order 
+from app.export import export_response, parse_date_range
+from app.models.orders import Order, SELLER_EXPORT_COLUMNS
 from app.models.inventory_items import InventoryItems
+from app.models.product_stats import ProductStats
 from app.models.helpers.db_exceptions_wrapper import handle_db_exceptions
 
 bp = Blueprint('inventory', __name__)
@@ -223,6 +225,8 @@ def add_new_product():
             ''', product_id=product_id, product_name=product_name, product_price=product_price,
                 seller_id=seller_id, product_quantity=product_quantity, category=product_category,
                 description=product_description, image=product_image)
+            ProductStats.create(product_id)
+            InventoryItems.product_changed(seller_id, product_id)
 
             flash('Product added successfully!', 'success')
             return redirect(url_for('inventory.view_inventory'))
@@ -323,3 +327,68 @@ def update_item_fulfillment_status():
     flash(f"Item status updated successfully to {new_status}.", "success")
     return redirect(url_for('inventory.order_dashboard_details', order_id=order_id))
 
+
+
+@bp.route('/update_items_fulfillment_status', methods=['POST'])
+@login_required
+def update_items_fulfillment_status():
+    """
+    Updates the fulfillment status of many line items at once: the items
+    checked on an order's details page (order_id:product_id values) or all
+    of the seller's items in the orders checked on the dashboard
+    """
+    seller_id = current_user.id
+    new_status = request.form.get('new_status', 'Fulfilled')
+    # Set by the details page, which the seller is sent back to
+    order_id = request.form.get('order_id', type=int)
+    back = (url_for('inventory.order_dashboard_details', order_id=order_id) if order_id
+            else url_for('inventory.orders_dashboard'))
+
+    allowed_statuses = ['Incomplete', 'Fulfilled']
+    if new_status not in allowed_statuses:
+        flash("Invalid fulfillment status.", "error")
+        return redirect(back)
+
+    try:
+        items = [tuple(int(part) for part in value.split(':'))
+                 for value in request.form.getlist('items')]
+    except ValueError:
+        items = None
+    if items is None or any(len(item) != 2 for item in items):
+        flash("Invalid items selected.", "error")
+        return redirect(back)
+    order_ids = request.form.getlist('order_ids', type=int)
+    if not items and not order_ids:
+        flash("No items selected.", "error")
+        return redirect(back)
+
+    if items:
+        result = Order.update_items_fulfillment_status(seller_id, items, new_status)
+        updated = len(set(items))
+    else:
+        result = updated = Order.update_orders_fulfillment_status(seller_id, order_ids, new_status)
+    if result == "failure":
+        flash("Could not update the selected items; none were changed.", "error")
+    else:
+        flash(f"{updated} item(s) updated successfully to {new_status}.", "success")
+    return redirect(back)
+
+
+@bp.route('/orders_dashboard/export')
+@login_required
+def export_seller_orders():
+    """
+    Downloads every item the seller sold, optionally in orders created
+    between the start and end dates, as CSV or NDJSON (format=ndjson),
+    streamed as it is read
+    """
+    seller_id = current_user.id
+    try:
+        start, end = parse_date_range(request.args)
+    except ValueError as e:
+        flash(f"Invalid date range: {e}", "error")
+        return redirect(url_for('inventory.orders_dashboard'))
+
+    rows = Order.stream_seller_lines(seller_id, start, end)
+    return export_response(SELLER_EXPORT_COLUMNS, rows, request.args.get('format'),
+                           f"sales-{seller_id}")
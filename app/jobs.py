@@ -0,0 +1,97 @@
+import random
+from threading import Event
+from .models.helpers.db_exceptions_wrapper import retry_transaction
+from .models.helpers.jobs import handler
+
+
+class JobWorker:
+    """
+    Runs the jobs of the Jobs table (enqueued with
+    app/models/helpers/jobs.py:enqueue) one at a time; start it with
+    `python worker.py`. Any number of workers may run side by side.
+
+    A job is claimed with FOR UPDATE SKIP LOCKED, so workers never wait on
+    each other, and leased for JOB_LEASE seconds: a job whose worker died is
+    claimed again once its lease runs out. The handler and the deletion of
+    the job commit together, so a job's effects are applied exactly once.
+    A failed job is retried after an exponential backoff, and set aside as
+    'dead' after JOB_MAX_ATTEMPTS attempts.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.db = app.db
+        self.logger = app.logger
+        self._stopped = Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        """Runs jobs until stop() is called, polling every JOB_POLL_INTERVAL
+        seconds while the queue is empty."""
+        self.logger.info("Job worker started")
+        while not self._stopped.is_set():
+            try:
+                ran = self.run_once()
+            except Exception as e:
+                self.logger.warning(f"Job worker could not claim a job: {str(e)}")
+                ran = False
+            if not ran:
+                self._stopped.wait(self.app.config['JOB_POLL_INTERVAL'])
+
+    def run_once(self):
+        """Claims and runs one runnable job; returns False if there was none."""
+        with self.app.app_context():
+            job = self._claim()
+            if job is None:
+                return False
+            job_id, kind, payload, attempts = job
+            func = handler(kind)
+            try:
+                if func is None:
+                    raise LookupError(f"No handler for jobs of kind {kind!r}")
+                retry_transaction(self._complete)(job_id, attempts, func, payload)
+            except Exception as e:
+                self._fail(job_id, kind, attempts, e)
+            return True
+
+    def _claim(self):
+        rows = self.db.execute('''
+        UPDATE Jobs
+        SET status = 'running', attempts = attempts + 1,
+            run_at = (current_timestamp AT TIME ZONE 'UTC') + make_interval(secs => :lease)
+        WHERE job_id = (SELECT job_id FROM Jobs
+                        WHERE status IN ('queued', 'running')
+                          AND run_at <= (current_timestamp AT TIME ZONE 'UTC')
+                        ORDER BY run_at, job_id
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED)
+        RETURNING job_id, kind, payload, attempts
+        ''', lease=self.app.config['JOB_LEASE'])
+        return rows[0] if rows else None
+
+    def _complete(self, job_id, attempts, func, payload):
+        func(**payload)
+        # A claim by another worker (after our lease ran out) bumps attempts
+        deleted = self.db.execute('''
+        DELETE FROM Jobs WHERE job_id = :job_id AND attempts = :attempts
+        ''', job_id=job_id, attempts=attempts)
+        if not deleted:
+            raise RuntimeError(f"Job {job_id} is no longer leased to this worker")
+
+    def _fail(self, job_id, kind, attempts, error):
+        config = self.app.config
+        dead = attempts >= config['JOB_MAX_ATTEMPTS']
+        delay = random.uniform(0.5, 1) * min(config['JOB_RETRY_MAX_DELAY'],
+                                             config['JOB_RETRY_BASE_DELAY'] * 2 ** attempts)
+        self.db.execute('''
+        UPDATE Jobs
+        SET status = :status, last_error = :error,
+            run_at = (current_timestamp AT TIME ZONE 'UTC') + make_interval(secs => :delay)
+        WHERE job_id = :job_id AND attempts = :attempts
+        ''', job_id=job_id, attempts=attempts, status='dead' if dead else 'queued',
+            error=str(error)[:2000], delay=delay)
+        self.db.incr('job_dead' if dead else 'job_failures')
+        log = self.logger.error if dead else self.logger.warning
+        log(f"Job {job_id} ({kind}) failed on attempt {attempts}{', giving up' if dead else ''}: {str(error)}")
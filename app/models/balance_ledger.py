@@ -0,0 +1,93 @@
+from threading import Event, Thread
+from flask import current_app as app
+from app.models.helpers.db_exceptions_wrapper import retry_transaction
+
+# A user's available balance: the balance folded into their Users row by the
+# last compaction plus the ledger entries not folded yet (u is the Users row)
+AVAILABLE_BALANCE = '''(u.balance + COALESCE((SELECT SUM(l.amount)
+                                 FROM BalanceLedger l
+                                 WHERE l.user_id = u.id AND NOT l.folded), 0))'''
+
+
+class BalanceLedger:
+    """
+    The append-only record of every change to a user's balance. Writers
+    insert an entry instead of updating the Users row, so concurrent credits
+    of a popular seller do not contend on one row. Users.balance is a
+    snapshot that compact() moves the entries into from time to time, in the
+    same transaction as it marks them folded, so the snapshot plus the
+    unfolded entries (AVAILABLE_BALANCE) is always the exact balance.
+
+    Debits must check the balance first, under the Users row lock (see
+    User.update_balance); credits need no lock, since they can only make a
+    concurrent debit check more conservative than necessary.
+    """
+
+    @staticmethod
+    def add(user_id, amount, reason, order_id=None):
+        app.db.execute('''
+        INSERT INTO BalanceLedger (user_id, amount, reason, order_id)
+        VALUES (:user_id, :amount, :reason, :order_id)
+        ''', user_id=user_id, amount=amount, reason=reason, order_id=order_id)
+
+    @staticmethod
+    @retry_transaction
+    def compact(limit=5000):
+        """Folds up to limit unfolded entries into their users' Users.balance;
+        returns how many were folded."""
+        rows = app.db.execute('''
+        WITH folded AS (
+            UPDATE BalanceLedger
+            SET folded = TRUE
+            WHERE entry_id IN (SELECT entry_id FROM BalanceLedger
+                               WHERE NOT folded
+                               ORDER BY entry_id
+                               LIMIT :limit
+                               FOR UPDATE SKIP LOCKED)
+            RETURNING user_id, amount
+        ), totals AS (
+            SELECT user_id, SUM(amount) AS amount, COUNT(*) AS entries
+            FROM folded
+            GROUP BY user_id
+        ), updated AS (
+            UPDATE Users u
+            SET balance = u.balance + t.amount
+            FROM totals t
+            WHERE u.id = t.user_id
+        )
+        SELECT COALESCE(SUM(entries), 0) FROM totals
+        ''', limit=limit)
+        return rows[0][0]
+
+
+class LedgerCompactor(Thread):
+    """Folds the balance ledger into the Users snapshots every interval
+    seconds, so balance reads only add up a few recent entries."""
+
+    def __init__(self, app, interval, batch_size=5000):
+        super().__init__(name='balance-ledger-compactor', daemon=True)
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stopped = Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.compact()
+            except Exception as e:
+                self.app.logger.warning(f"Balance ledger compaction failed: {str(e)}")
+
+    def compact(self):
+        """Runs one compaction; returns the number of entries folded."""
+        total = 0
+        with self.app.app_context():
+            while not self._stopped.is_set():
+                folded = BalanceLedger.compact(self.batch_size)
+                total += folded
+                if folded < self.batch_size:
+                    break
+        return total
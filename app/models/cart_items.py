@@ -1,13 +1,17 @@
 from flask import current_app
 from app.models.helpers.db_exceptions_wrapper import handle_db_exceptions
+from app.models.helpers.db_pool import use_pool
+from app.models.helpers.row_model import RowModel
+from app.models.helpers.pagination import window_count
 from app.models.coupons import Coupons
+from app.models.inventory_holds import InventoryHolds
 
 from flask import current_app
 from app.models.helpers.db_exceptions_wrapper import handle_db_exceptions
 from app.models.coupons import Coupons
 
 
-class CartItems:
+class CartItems(RowModel):
     """
     This class represents all the items within a user's cart. It provides API services
     to add, remove, and update item quantities from the cart. Additionally, it provides
@@ -16,13 +20,8 @@ class CartItems:
     methods to view the items and calculate the total cost of all items in the cart.
     """
 
-    def __init__(self, product_id, seller_id, order_id, quantity, unit_price, product_name):
-        self.product_id = product_id
-        self.seller_id = seller_id
-        self.order_id = order_id
-        self.quantity = quantity
-        self.unit_price = unit_price
-        self.product_name = product_name
+    __slots__ = ()
+    _fields = ('product_id', 'seller_id', 'order_id', 'quantity', 'unit_price', 'product_name')
 
     @staticmethod
     def get_all_cart_items(user_id) -> list:
@@ -40,7 +39,7 @@ class CartItems:
             """,
             user_id=user_id,
         )
-        items_in_cart = [CartItems(row[0], row[1], row[2], row[3], row[4], row[5]) for row in rows]
+        items_in_cart = CartItems.from_rows(rows)
         return items_in_cart
 
     @staticmethod
@@ -55,7 +54,8 @@ class CartItems:
         offset = (page - 1) * per_page
         rows = current_app.db.execute(
             """
-            SELECT cp.product_id, cp.seller_id, cp.order_id, cp.quantity, cp.unit_price, p.product_name
+            SELECT cp.product_id, cp.seller_id, cp.order_id, cp.quantity, cp.unit_price, p.product_name,
+                   COUNT(*) OVER () AS total_items
             FROM CartProducts cp
             JOIN Cart c ON cp.order_id = c.order_id
             JOIN Products p ON cp.product_id = p.product_id AND cp.seller_id = p.seller_id
@@ -66,7 +66,7 @@ class CartItems:
             per_page=per_page,
             offset=offset,
         )
-        total_items = current_app.db.execute(
+        total_items = window_count(rows, lambda: current_app.db.execute(
             """
             SELECT COUNT(*)
             FROM CartProducts cp
@@ -74,14 +74,15 @@ class CartItems:
             WHERE c.user_id = :user_id AND c.purchase_status = 'Pending'
             """,
             user_id=user_id,
-        )[0][0]
+        )[0][0])
 
-        items_in_cart = [CartItems(row[0], row[1], row[2], row[3], row[4], row[5]) for row in rows]
+        items_in_cart = CartItems.from_rows(rows)
         return items_in_cart, total_items
 
 
     @staticmethod
     @handle_db_exceptions
+    @use_pool('checkout')
     def add_item(user_id, product_id, quantity, seller_id):
         """
         Adds an item to the cart after checking inventory.
@@ -91,8 +92,10 @@ class CartItems:
         @param seller_id: The seller ID associated with the product.
         """
 
-        # 1. Check inventory
-        available_quantity = CartItems._get_available_inventory(product_id, seller_id)
+        # 1. Lock the offer and check the stock not held by other carts
+        # (the user's cart, if any, is created only once the offer checks out)
+        order_id = CartItems._get_pending_cart_id(user_id)
+        available_quantity = InventoryHolds.available(product_id, seller_id, order_id)
         if available_quantity is None:
             return "Product not found in inventory."
         if quantity > available_quantity:
@@ -104,17 +107,20 @@ class CartItems:
             return "Product not found."
 
         # 3. Validation for if the product is already in the cart
-        order_id = CartItems._get_or_create_pending_cart(user_id)
+        if order_id is None:
+            order_id = CartItems._get_or_create_pending_cart(user_id)
         existing_item = CartItems._get_existing_cart_item(order_id, product_id, seller_id)
-        
+        new_quantity = quantity + (existing_item[0][0] if existing_item else 0)
+        if new_quantity > available_quantity:
+            return "Not enough inventory available for the requested quantity."
+
         if existing_item:
-            new_quantity = existing_item[0][0] + quantity
-            if new_quantity > available_quantity:
-                return "Not enough inventory available for the requested quantity."
             CartItems._update_cart_item(order_id, product_id, seller_id, new_quantity)
         else:
             CartItems._insert_cart_item(order_id, product_id, seller_id, quantity, unit_price)
 
+        # 4. Hold the line's stock until checkout (or until the hold expires)
+        InventoryHolds.hold(order_id, product_id, seller_id, new_quantity)
         return "success"
     
     @staticmethod
@@ -152,6 +158,7 @@ class CartItems:
 
     @staticmethod
     @handle_db_exceptions
+    @use_pool('checkout')
     def update_item_quantity(user_id, product_id, seller_id, new_quantity):
         """
         Updates the quantity of an item in the cart.
@@ -167,10 +174,11 @@ class CartItems:
         if new_quantity <= 0:
             return CartItems.remove_item(user_id, product_id, seller_id)
 
-        if not CartItems._is_valid_quantity(product_id, seller_id, new_quantity):
+        if not CartItems._is_valid_quantity(order_id, product_id, seller_id, new_quantity):
             return "Not enough inventory available."
 
         CartItems._update_cart_item(order_id, product_id, seller_id, new_quantity)
+        InventoryHolds.hold(order_id, product_id, seller_id, new_quantity)
         return "success"
     
     @staticmethod
@@ -225,18 +233,6 @@ class CartItems:
         )
         return "success"
 
-    @staticmethod
-    def _get_available_inventory(product_id, seller_id):
-        inventory_row = current_app.db.execute(
-            """
-            SELECT product_quantity FROM Products
-            WHERE product_id = :product_id AND seller_id = :seller_id
-            """,
-            product_id=product_id,
-            seller_id=seller_id,
-        )
-        return inventory_row[0][0] if inventory_row else None
-
     @staticmethod
     def _get_or_create_pending_cart(user_id):
         rows = current_app.db.execute(
@@ -249,15 +245,17 @@ class CartItems:
         if rows:
             return rows[0][0]
         else:
+            # A concurrent request may create it first (see cart_pending_idx)
             new_cart = current_app.db.execute(
                 """
                 INSERT INTO Cart (user_id, total_price, purchase_status)
                 VALUES (:user_id, 0.0, 'Pending')
+                ON CONFLICT (user_id) WHERE purchase_status = 'Pending' DO NOTHING
                 RETURNING order_id
                 """,
                 user_id=user_id,
             )
-            return new_cart[0][0]
+            return new_cart[0][0] if new_cart else CartItems._get_pending_cart_id(user_id)
 
     @staticmethod
     def _get_product_price(product_id, seller_id):
@@ -336,8 +334,8 @@ class CartItems:
             seller_id=seller_id,
         )
     @staticmethod
-    def _is_valid_quantity(product_id, seller_id, requested_quantity):
-        available_quantity = CartItems._get_available_inventory(product_id, seller_id)
+    def _is_valid_quantity(order_id, product_id, seller_id, requested_quantity):
+        available_quantity = InventoryHolds.available(product_id, seller_id, order_id)
         return (
             available_quantity is not None and requested_quantity <= available_quantity
         )
@@ -1,11 +1,27 @@
 from flask import current_app
-from app.models.cart_items import CartItems
 from app.models.helpers.db_exceptions_wrapper import handle_db_exceptions
+from app.models.helpers.cache import invalidate
+from app.models.helpers.db_pool import use_pool
+from app.models.helpers.jobs import enqueue, job
+from app.models.helpers.row_model import RowModel
+from app.models.balance_ledger import AVAILABLE_BALANCE
+from app.models.inventory_holds import InventoryHolds
+from app.models.product_offers import ProductOffers
+from app.models.seller_order_status import SellerOrderStatus
 from app.models.user import User
 from app.models.coupons import Coupons
 from flask_login import current_user
 from decimal import Decimal
 
+class CheckoutLine(RowModel):
+    """A line of the cart being checked out, with the stock it may take
+    (product_quantity, net of other carts' holds) and (repeated on every line)
+    the cart's coupon and the buyer's balance and address."""
+    __slots__ = ()
+    _fields = ('product_id', 'seller_id', 'order_id', 'quantity', 'unit_price', 'product_name',
+               'product_quantity', 'available', 'coupon_code', 'balance', 'address')
+
+
 class CartSubmission:
     """
     This class handles the submission of the cart, including balance checks,
@@ -14,151 +30,234 @@ class CartSubmission:
 
     @staticmethod
     @handle_db_exceptions
-    def submit_cart(user_id):
+    @use_pool('checkout')
+    def submit_cart(user_id, idempotency_key=None):
         """
         Submits the cart as an order after checking product availability, user balance,
-        and updating inventories and balances.
+        and updating inventories and balances. The whole cart is validated and applied
+        with a fixed number of statements, however many lines it has.
         @param user_id: The user ID submitting the order.
+        @param idempotency_key: Identifies the submission (e.g. one per rendering of the
+        cart page). A repeated submission with the same key returns the first one's
+        result without checking out again; one made while the first is still running
+        waits for it to finish.
+        """
+        if idempotency_key:
+            stored_result = CartSubmission._claim_idempotency_key(user_id, idempotency_key)
+            if stored_result is not None:
+                return stored_result
+        result = CartSubmission._checkout(user_id)
+        if idempotency_key:
+            CartSubmission._store_result(user_id, idempotency_key, result)
+        return result
+
+    @staticmethod
+    def _claim_idempotency_key(user_id, idempotency_key):
         """
-        # 1. Fetch the user's cart items
-        cart_items = CartItems.get_all_cart_items(user_id)
-        if not cart_items:
+        Records the key for this transaction and returns None, or returns the
+        stored result if the key was used before. A concurrent submission with
+        the same key blocks on the insert until the first one commits (then its
+        result is returned) or rolls back (then this one proceeds).
+        """
+        claimed = current_app.db.execute(
+            """
+            INSERT INTO CheckoutRequests (user_id, idempotency_key, result)
+            VALUES (:user_id, :idempotency_key, '')
+            ON CONFLICT (user_id, idempotency_key) DO NOTHING
+            RETURNING 1
+            """,
+            user_id=user_id,
+            idempotency_key=idempotency_key
+        )
+        if claimed:
+            return None
+        # A statement of its own, so that it sees the row of the submission we waited for
+        rows = current_app.db.execute(
+            """
+            SELECT result FROM CheckoutRequests
+            WHERE user_id = :user_id AND idempotency_key = :idempotency_key
+            """,
+            user_id=user_id,
+            idempotency_key=idempotency_key
+        )
+        return rows[0][0]
+
+    @staticmethod
+    def _store_result(user_id, idempotency_key, result):
+        current_app.db.execute(
+            """
+            UPDATE CheckoutRequests SET result = :result
+            WHERE user_id = :user_id AND idempotency_key = :idempotency_key
+            """,
+            user_id=user_id,
+            idempotency_key=idempotency_key,
+            result=result
+        )
+
+    @staticmethod
+    def _checkout(user_id):
+        # 1. Lock and fetch the cart lines with their inventory, and the buyer
+        lines = CartSubmission._lock_cart(user_id)
+        if not lines:
             return "Your cart is empty."
+        order_id = lines[0].order_id
 
         # 2. Calculate total cart cost and apply coupons if applicable
-        total_cost = sum(Decimal(item.quantity) * item.unit_price for item in cart_items)
-        coupon_code = CartItems.get_coupon_code(user_id)
-        discount_percentage = 0
-        discount_amount = Decimal('0.00')
+        total_cost = sum(Decimal(line.quantity) * line.unit_price for line in lines)
+        coupon_code = lines[0].coupon_code
         if coupon_code:
             discount_percentage = Coupons.get_discount(coupon_code) or 0
-            discount_rate = Decimal(discount_percentage) / Decimal('100')
-            discount_amount = total_cost * discount_rate
-            total_cost -= discount_amount
+            total_cost -= total_cost * Decimal(discount_percentage) / Decimal('100')
 
         # 3. Check user balance & address
-        user_balance = User.get_balance(user_id)
-        if user_balance < total_cost:
+        if lines[0].balance < total_cost:
             return "Insufficient balance to complete the purchase."
-        
-        user_address = User.get_address(user_id)
-        if user_address == " " or user_address == "":
+        if lines[0].address in (" ", ""):
             return "No address on file. Please add an address to your account to complete your order."
 
         # 4. Check product availability
-        for item in cart_items:
-            available_quantity = CartItems._get_available_inventory(item.product_id, item.seller_id)
-            if available_quantity is None or available_quantity < item.quantity:
-                return f"Not enough inventory for {item.product_name}."
-
-        # 5. Deduct the total cost from user's balance
-        deduct_total = -1 * total_cost
-        User.update_balance(user_id, deduct_total)
-
-        # 6. Update seller balances and inventory
-        for item in cart_items:
-            CartSubmission._decrease_inventory(item.product_id, item.seller_id, item.quantity)
-            CartSubmission._increase_seller_balance(
-                item.seller_id, item.quantity * item.unit_price
-            )
-
-        # 7. Check if an order already exists
-        order_id = CartItems._get_pending_cart_id(user_id)
-        result = current_app.db.execute(
+        for line in lines:
+            if not line.available or line.product_quantity < line.quantity:
+                return f"Not enough inventory for {line.product_name}."
+
+        # 5. Deduct the total cost from user's balance (already checked under the
+        # lock; should the debit still be refused, nothing of the order is written)
+        if not User.update_balance(user_id, -total_cost, 'purchase', order_id):
+            raise RuntimeError(f"Balance debit of {total_cost} refused for order {order_id}")
+
+        # 6. Update inventory in one statement; the sellers are credited, their
+        # sales rollups updated and the product offer summaries refreshed by the
+        # job worker once this commits
+        CartSubmission._decrease_inventory(lines)
+        enqueue('credit_sellers', order_id=order_id)
+        enqueue('record_sales', order_id=order_id)
+        enqueue('refresh_product_offers', product_ids=sorted({line.product_id for line in lines}))
+
+        # 7. Create the order, or update the one left by an earlier attempt.
+        # The cart's lines already are its CartProducts rows
+        current_app.db.execute(
             """
-            SELECT 1 FROM Orders WHERE order_id = :order_id
+            INSERT INTO Orders (order_id, user_id, created_at, total_price, fulfillment_status, coupon_code)
+            VALUES (:order_id, :user_id, current_timestamp, :total_price, 'Incomplete', :coupon_code)
+            ON CONFLICT (order_id) DO UPDATE
+            SET fulfillment_status = 'Incomplete',
+                total_price = EXCLUDED.total_price,
+                coupon_code = EXCLUDED.coupon_code
             """,
-            order_id=order_id
+            order_id=order_id,
+            user_id=user_id,
+            total_price=total_cost,
+            coupon_code=coupon_code
         )
-        existing_order = result[0] if result else None
-
-        # 8. Insert or update the order as necessary
-        if existing_order is None:
-            # Order does not exist, create a new one
-            current_app.db.execute(
-                """
-                INSERT INTO Orders (order_id, user_id, created_at, total_price, fulfillment_status, coupon_code)
-                VALUES (:order_id, :user_id, current_timestamp, :total_price, 'Incomplete', :coupon_code)
-                """,
-                order_id=order_id,
-                user_id=user_id,
-                total_price=total_cost,
-                coupon_code=coupon_code
-            )
-        else:
-            # Order exists, optionally update its status
-            current_app.db.execute(
-                """
-                UPDATE Orders
-                SET fulfillment_status = 'Incomplete', total_price = :total_price, coupon_code = :coupon_code
-                WHERE order_id = :order_id
-                """,
-                order_id=order_id,
-                total_price=total_cost,
-                coupon_code=coupon_code
-            )
-        
-        # 9. Delete existing entries in CartProducts for this order_id
+        SellerOrderStatus.create(order_id)
+        invalidate(("orders", user_id))
+
+        # 8. Mark cart as purchased (change purchase_status to 'Completed'); its
+        # stock is taken, so its holds are no longer needed
+        CartSubmission._mark_cart_as_completed(order_id, total_cost)
+        InventoryHolds.release(order_id)
+        return "Purchase successful!"
+
+    @staticmethod
+    def _lock_cart(user_id):
+        """
+        Returns the lines of user_id's pending cart with their inventory (net of
+        the other carts' active holds), the cart's coupon and the buyer's balance
+        and address. The buyer, the cart and the lines' Products rows (in key
+        order, so checkouts cannot deadlock on each other) are locked first
+        until the transaction ends, so nothing checked here can change before
+        it is applied.
+        """
         current_app.db.execute(
             """
-            DELETE FROM CartProducts WHERE order_id = :order_id
+            SELECT 1
+            FROM Cart c
+            JOIN Users u ON u.id = c.user_id
+            JOIN CartProducts cp ON cp.order_id = c.order_id
+            JOIN Products p ON p.product_id = cp.product_id AND p.seller_id = cp.seller_id
+            WHERE c.user_id = :user_id AND c.purchase_status = 'Pending'
+            ORDER BY cp.product_id, cp.seller_id
+            FOR UPDATE OF c, u, p
             """,
-            order_id=order_id
+            user_id=user_id,
         )
-        
-        # 10. Insert items into CartProducts
-        for item in cart_items:
-            current_app.db.execute(
-                """
-                INSERT INTO CartProducts (order_id, product_id, quantity, unit_price, seller_id, fulfillment_status)
-                VALUES (:order_id, :product_id, :quantity, :unit_price, :seller_id, 'Incomplete')
-                """,
-                order_id=order_id,
-                product_id=item.product_id,
-                quantity=item.quantity,
-                unit_price=item.unit_price,
-                seller_id=item.seller_id
-            )
-
-        
-        # 11. Mark cart as purchased (change purchase_status to 'Completed')       
-        CartSubmission._mark_cart_as_completed(user_id)
-        return "Purchase successful!"
+        # Read under the locks in a statement of its own, so that (at READ
+        # COMMITTED) it sees everything committed before they were granted
+        rows = current_app.db.execute(
+            f"""
+            SELECT cp.product_id, cp.seller_id, cp.order_id, cp.quantity, cp.unit_price,
+                   p.product_name,
+                   p.product_quantity - COALESCE((
+                       SELECT SUM(h.quantity)
+                       FROM InventoryHolds h
+                       WHERE h.product_id = cp.product_id AND h.seller_id = cp.seller_id
+                         AND h.order_id <> cp.order_id
+                         AND h.expires_at > (current_timestamp AT TIME ZONE 'UTC')), 0),
+                   p.available, c.coupon_code, {AVAILABLE_BALANCE}, u.address
+            FROM Cart c
+            JOIN Users u ON u.id = c.user_id
+            JOIN CartProducts cp ON cp.order_id = c.order_id
+            JOIN Products p ON p.product_id = cp.product_id AND p.seller_id = cp.seller_id
+            WHERE c.user_id = :user_id AND c.purchase_status = 'Pending'
+            ORDER BY cp.product_id, cp.seller_id
+            """,
+            user_id=user_id,
+        )
+        return CheckoutLine.from_rows(rows)
 
     @staticmethod
-    def _increase_seller_balance(seller_id, amount):
+    @job('credit_sellers')
+    def _increase_seller_balances(order_id):
+        """Credits every seller of the order once with the total of their lines,
+        as ledger entries, so popular sellers' Users rows are not contended."""
         current_app.db.execute(
             """
-            UPDATE Users
-            SET balance = balance + :amount
-            WHERE id = :seller_id
+            INSERT INTO BalanceLedger (user_id, amount, reason, order_id)
+            SELECT seller_id, SUM(quantity * unit_price), 'sale', :order_id
+            FROM CartProducts
+            WHERE order_id = :order_id
+            GROUP BY seller_id
             """,
-            seller_id=seller_id,
-            amount=amount,
+            order_id=order_id,
         )
 
     @staticmethod
-    def _decrease_inventory(product_id, seller_id, quantity):
-        current_app.db.execute(
+    @job('refresh_product_offers')
+    def _refresh_product_offers(product_ids):
+        """Brings the offer summaries of the products sold up to date, and drops
+        the cached product data and listing counts (as InventoryItems.product_changed
+        does); an offer that sold out can leave the catalog or a category."""
+        ProductOffers.refresh(*product_ids)
+        invalidate(*{("product", product_id) for product_id in product_ids}, "categories", "products")
+
+    @staticmethod
+    def _decrease_inventory(cart_items):
+        # Only decrements lines that still have the stock; the rows are locked by
+        # _lock_cart, so a shortfall here means the cart changed under us
+        updated = current_app.db.execute_many(
             """
-            UPDATE Products
-            SET product_quantity = product_quantity - :quantity
-            WHERE product_id = :product_id AND seller_id = :seller_id
+            UPDATE Products p
+            SET product_quantity = p.product_quantity - v.quantity
+            FROM (VALUES :values) AS v(product_id, seller_id, quantity)
+            WHERE p.product_id = v.product_id AND p.seller_id = v.seller_id
+              AND p.product_quantity >= v.quantity
             """,
-            product_id=product_id,
-            seller_id=seller_id,
-            quantity=quantity
+            [(item.product_id, item.seller_id, item.quantity) for item in cart_items],
         )
+        if updated != len(cart_items):
+            raise RuntimeError(f"Inventory changed during checkout: {updated} of {len(cart_items)} lines updated")
+        invalidate(*{("product", item.product_id) for item in cart_items})
 
     
     @staticmethod
-    def _mark_cart_as_completed(user_id):
+    def _mark_cart_as_completed(order_id, total_price):
         current_app.db.execute(
             """
             UPDATE Cart
-            SET purchase_status = 'Completed'
-            WHERE user_id = :user_id AND purchase_status = 'Pending'
+            SET purchase_status = 'Completed', total_price = :total_price
+            WHERE order_id = :order_id
             """,
-            user_id=user_id
+            order_id=order_id,
+            total_price=total_price
         )
     
@@ -1,7 +1,9 @@
 from flask import current_app
+from app.models.helpers.cache import cached
 
 class Coupons:
     @staticmethod
+    @cached(lambda coupon_code: ('coupon', coupon_code))
     def get_discount(coupon_code):
         """
         Retrieves the discount percentage for a valid coupon code.
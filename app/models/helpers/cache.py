@@ -0,0 +1,54 @@
+from functools import wraps
+from flask import current_app, g, has_app_context
+from app.cache import encode_tags
+
+
+def cached(tag):
+    """
+    A decorator that serves a model method from current_app.cache, keyed by
+    its arguments. tag(*args, **kwargs) names the data the result is computed
+    from, e.g. lambda product_id: ('product', product_id), so that the write
+    paths changing that data can drop it with invalidate(). Cached results
+    are shared between requests and must not be modified by callers.
+
+    Once the unit of work has invalidated anything, its reads bypass the
+    cache until it commits or rolls back: they may see its uncommitted
+    writes, which must not be served to other requests.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if has_app_context() and g.get('_cache_invalidating'):
+                return func(*args, **kwargs)
+            key = (tag(*args, **kwargs), func.__qualname__, args, tuple(sorted(kwargs.items())))
+            return current_app.cache.get_or_set(key, lambda: func(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def invalidate(*tags):
+    """
+    Drops the cached entries of tags now, and again once the unit of work
+    commits or rolls back, so that an entry a concurrent request re-read in
+    the meantime cannot outlive it; until then, the unit of work's own
+    cached() reads go to the database. The tags are also NOTIFYed on
+    CACHE_INVALIDATION_CHANNEL within the unit of work, so the other worker
+    processes drop them when (and only if) it commits; see
+    InvalidationListener in app/cache.py.
+    """
+    cache = current_app.cache
+
+    def drop():
+        g.pop('_cache_invalidating', None)
+        for tag in tags:
+            cache.invalidate(tag)
+    drop()
+    g._cache_invalidating = True
+    current_app.db.after_commit(drop)
+    current_app.db.after_rollback(drop)
+
+    channel = current_app.config['CACHE_INVALIDATION_CHANNEL']
+    if channel:
+        for payload in encode_tags(tags):
+            current_app.db.execute('SELECT pg_notify(:channel, :payload)',
+                                   channel=channel, payload=payload)
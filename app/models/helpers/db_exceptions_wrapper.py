@@ -1,20 +1,88 @@
+import random
+import time
 from functools import wraps
-from flask import current_app
+from flask import current_app, g
+from sqlalchemy.exc import DBAPIError
+
+# SQLSTATEs of transactions that lost a race and can simply be run again:
+# serialization_failure and deadlock_detected
+RETRYABLE_SQLSTATES = ('40001', '40P01')
+
+
+def is_retryable(error):
+    """Returns True if error aborted the transaction only because of a concurrent one."""
+    return isinstance(error, DBAPIError) and getattr(error.orig, 'pgcode', None) in RETRYABLE_SQLSTATES
+
+
+def retry_transaction(func):
+    """
+    A decorator that runs func as one unit of work and commits it. If the unit
+    of work aborts on a serialization failure or deadlock, it is rolled back and
+    func is run again from the start, after a jittered exponential backoff, up to
+    DB_RETRY_ATTEMPTS times. Other exceptions, and the last retryable one, are
+    re-raised after the rollback. Calls nested inside another decorated call join
+    the outer unit of work instead of committing or retrying on their own.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if g.get('_db_tx_depth', 0):
+            g._db_tx_depth += 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                g._db_tx_depth -= 1
+
+        db = current_app.db
+        attempts = current_app.config['DB_RETRY_ATTEMPTS']
+        with db.unit_of_work():
+            # Start on a transaction boundary, so a retry re-runs func only
+            db.commit()
+            for attempt in range(1, attempts + 1):
+                g._db_tx_depth = 1
+                try:
+                    result = func(*args, **kwargs)
+                    db.commit()
+                    return result
+                except Exception as e:
+                    db.rollback()
+                    if not is_retryable(e):
+                        raise
+                    if attempt == attempts:
+                        db.incr('retry_give_ups')
+                        current_app.logger.warning(
+                            f"Giving up on {func.__name__} after {attempts} attempts: {str(e.orig)}")
+                        raise
+                    db.incr('retries')
+                    time.sleep(_backoff(attempt))
+                finally:
+                    g._db_tx_depth = 0
+    return wrapper
+
+
+def _backoff(attempt):
+    """Full-jitter exponential backoff for the given (1-based) attempt."""
+    base = current_app.config['DB_RETRY_BASE_DELAY']
+    cap = current_app.config['DB_RETRY_MAX_DELAY']
+    return random.uniform(0, min(cap, base * 2 ** attempt))
 
 
 def handle_db_exceptions(func):
     """
     A decorator to handle database exceptions, logging, and transactions.
     Commits the transaction if no exceptions occur, otherwise rolls back.
+    Serialization failures and deadlocks are retried (see retry_transaction)
+    before the call is given up on.
     """
+    transaction = retry_transaction(func)
+
     @wraps(func)
     def wrapper(*args, **kwargs):
+        if g.get('_db_tx_depth', 0):
+            # Nested call: the outermost call commits, retries or reports
+            return transaction(*args, **kwargs)
         try:
-            result = func(*args, **kwargs)
-            current_app.db.commit()
-            return result
+            return transaction(*args, **kwargs)
         except Exception as e:
             current_app.logger.error(f"Database operation failed in {func.__name__}: {str(e)}")
-            current_app.db.rollback()
             return "failure"
-    return wrapper
\ No newline at end of file
+    return wrapper
@@ -0,0 +1,17 @@
+from functools import wraps
+from flask import current_app
+
+
+def use_pool(name):
+    """
+    A decorator that runs every query of the wrapped function on the named
+    connection pool (see Config.DB_POOLS), keeping e.g. slow analytics off
+    the connections that checkout depends on.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with current_app.db.use_pool(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,35 @@
+import json
+from flask import current_app
+
+# Handlers of the job kinds, registered with @job
+_handlers = {}
+
+
+def job(kind):
+    """
+    A decorator that registers func as the handler of jobs of the given kind.
+    Jobs are enqueued with enqueue(kind, **payload) and run later by a worker
+    process (see app/jobs.py), which calls func(**payload) in a transaction of
+    its own. Handlers must be safe to run again after a failed attempt.
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def handler(kind):
+    """Returns the handler registered for kind, or None."""
+    return _handlers.get(kind)
+
+
+def enqueue(kind, **payload):
+    """
+    Queues a job of kind with the JSON-serializable keyword arguments payload.
+    The job is part of the current unit of work, so it only runs if the work
+    that enqueued it commits.
+    """
+    current_app.db.execute('''
+    INSERT INTO Jobs (kind, payload)
+    VALUES (:kind, CAST(:payload AS JSONB))
+    ''', kind=kind, payload=json.dumps(payload))
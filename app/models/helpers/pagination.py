@@ -0,0 +1,153 @@
+import base64
+import binascii
+import json
+from decimal import Decimal, InvalidOperation
+from flask import current_app
+
+
+class Keyset:
+    """
+    The sort key of a keyset (seek) paginated query: a list of
+    (expression, SQL type, column name) triples that ends in a unique
+    tie-breaker, all sorted in the same direction. Instead of skipping
+    OFFSET rows, a page starts right after (or, going backwards, right
+    before) the key of the row the previous page ended on, so every page
+    costs the same no matter how deep it is.
+
+    >>> keyset = Keyset([('p.price', 'DECIMAL', 'price'),
+    >>>                  ('p.product_id', 'INT', 'product_id')])
+    >>> condition, params = keyset.seek(keyset.values(last_row))
+    >>> app.db.execute(f'SELECT ... WHERE {condition} {keyset.order_by()} LIMIT 10', **params)
+    """
+
+    def __init__(self, keys, descending=False):
+        self.keys = keys
+        self.descending = descending
+
+    def order_by(self, backwards=False):
+        direction = 'ASC' if self.descending == backwards else 'DESC'
+        return 'ORDER BY ' + ', '.join(f'{expression} {direction}' for expression, _, _ in self.keys)
+
+    def seek(self, values, backwards=False):
+        """Returns the WHERE condition selecting the rows after the key
+        values (before them, if backwards) and its parameters."""
+        op = '>' if self.descending == backwards else '<'
+        params = {f'seek_{i}': value for i, value in enumerate(values)}
+        expressions = [expression for expression, _, _ in self.keys]
+        marks = [f'CAST(:seek_{i} AS {sql_type})' for i, (_, sql_type, _) in enumerate(self.keys)]
+        condition = f"({', '.join(expressions)}) {op} ({', '.join(marks)})"
+        if len(self.keys) > 1:
+            # Redundant bound on the leading keys alone, which an index on
+            # them can use even when the tie-breaker lives in another table
+            condition += f" AND ({', '.join(expressions[:-1])}) {op}= ({', '.join(marks[:-1])})"
+        return condition, params
+
+    def values(self, row):
+        """The key values of a result row."""
+        return [getattr(row, name) for _, _, name in self.keys]
+
+    def parse(self, values):
+        """
+        Converts key values read back from a cursor to their columns' types
+        (int, Decimal, float or str), so that they are safe to seek() with.
+        Raises ValueError if there are not as many values as keys or one of
+        them does not fit its column.
+        """
+        if not isinstance(values, list) or len(values) != len(self.keys):
+            raise ValueError("Wrong number of key values")
+        return [_parse_key(value, sql_type) for value, (_, sql_type, _) in zip(values, self.keys)]
+
+
+def _parse_key(value, sql_type):
+    # Cursors only hold JSON scalars; booleans are ints to Python but not to SQL
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"Bad key value {value!r}")
+    if sql_type == 'INT':
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError(f"Bad INT key value {value!r}")
+        value = int(value)
+        if not -2 ** 31 <= value < 2 ** 31:
+            raise ValueError(f"INT key value out of range: {value}")
+        return value
+    if sql_type in ('DECIMAL', 'REAL'):
+        try:
+            value = Decimal(str(value))
+        except InvalidOperation:
+            raise ValueError(f"Bad {sql_type} key value {value!r}")
+        if not value.is_finite():
+            raise ValueError(f"Bad {sql_type} key value {value!r}")
+        return value if sql_type == 'DECIMAL' else float(value)
+    return str(value)
+
+
+def encode_cursor(sort, values, page, backwards=False):
+    """
+    Packs a position in a listing into an opaque URL-safe token: the sort
+    mode it belongs to, the key values to seek from, the direction and the
+    page number it leads to (for display only).
+    """
+    data = {'s': sort, 'k': [str(v) if isinstance(v, Decimal) else v for v in values], 'p': page}
+    if backwards:
+        data['b'] = 1
+    raw = json.dumps(data, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, sort, keyset):
+    """
+    Unpacks a token made by encode_cursor() into (values, page, backwards),
+    with the values converted to the types of keyset's columns (see
+    Keyset.parse). Returns None if the token is malformed, belongs to another
+    sort mode or its values do not fit keyset, e.g. after being edited.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw)
+        if not isinstance(data, dict) or data['s'] != sort:
+            return None
+        page = data['p']
+        if isinstance(page, bool) or not isinstance(page, int) or page < 1:
+            return None
+        return keyset.parse(data['k']), page, bool(data.get('b'))
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        return None
+
+
+# Total row counts for paginated listings. Pick the strategy per call site:
+# window_count() when the page query can carry the count itself, cached_count()
+# when the total is needed apart from the page rows and changes rarely, and
+# estimated_count() for large listings where an approximate total will do.
+
+def window_count(rows, fallback):
+    """
+    Returns the total of a page query that selects COUNT(*) OVER () as its
+    last column, which PostgreSQL computes before LIMIT/OFFSET apply. An
+    empty page (past the end) carries no count, so fallback() is called to
+    compute it instead.
+    """
+    return rows[0][-1] if rows else fallback()
+
+
+def cached_count(tag, sql, ttl=None, **params):
+    """
+    Runs the COUNT query sql, caching the result under tag for ttl seconds
+    (Config.COUNT_CACHE_TTL by default). Writers that change the counted rows
+    call current_app.cache.invalidate(tag).
+    """
+    key = (tag, sql, tuple(sorted(params.items())))
+    return current_app.cache.get_or_set(
+        key, lambda: current_app.db.execute(sql, **params)[0][0],
+        current_app.config['COUNT_CACHE_TTL'] if ttl is None else ttl)
+
+
+def estimated_count(sql, **params):
+    """
+    Returns the planner's estimate of the number of rows query sql returns,
+    without running it. Only as accurate as the table statistics. sql must
+    select the rows to count (e.g. SELECT 1 FROM ... WHERE ...), not their
+    COUNT(*): the plan of an aggregate estimates its own single result row.
+    """
+    plan = current_app.db.execute(f"EXPLAIN (FORMAT JSON) {sql}", **params)[0][0][0]['Plan']
+    if plan['Node Type'] == 'Aggregate' and plan.get('Strategy') == 'Plain':
+        raise ValueError("estimated_count() needs the rows to count, not an aggregate of them")
+    return int(plan['Plan Rows'])
@@ -0,0 +1,75 @@
+from operator import itemgetter
+
+_MISSING = object()
+
+
+class RowModel:
+    """
+    Base class for read-only model objects backed by a result row.
+
+    A subclass lists its columns in _fields, in the order its queries SELECT
+    them, and declares __slots__ = (). Each field becomes a property that
+    reads straight from the wrapped row, so from_row()/from_rows() map a
+    result set to objects without copying any column value or allocating a
+    per-instance __dict__. Rows shorter than _fields (queries that select
+    only the leading columns) are padded with the values in _defaults.
+
+    Objects also support row['field'] lookups and _asdict(), for code written
+    against the dicts some model methods used to return.
+    """
+    __slots__ = ('_row',)
+    _fields = ()
+    _defaults = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._index = {name: i for i, name in enumerate(cls._fields)}
+        cls._padding = tuple(cls._defaults.get(name) for name in cls._fields)
+        for i, name in enumerate(cls._fields):
+            setattr(cls, name, property(itemgetter(i), doc=name))
+
+    def __init__(self, *args, **kwargs):
+        if len(args) > len(self._fields):
+            raise TypeError(f"{type(self).__name__} takes at most {len(self._fields)} values")
+        values = list(args) + [_MISSING] * (len(self._fields) - len(args))
+        for name, value in kwargs.items():
+            if name not in self._index:
+                raise TypeError(f"{type(self).__name__} has no field '{name}'")
+            values[self._index[name]] = value
+        for i, name in enumerate(self._fields):
+            if values[i] is _MISSING:
+                if name not in self._defaults:
+                    raise TypeError(f"{type(self).__name__} is missing field '{name}'")
+                values[i] = self._defaults[name]
+        self._row = tuple(values)
+
+    @classmethod
+    def from_row(cls, row):
+        """Wraps a result row (or any tuple in _fields order) without copying it."""
+        obj = cls.__new__(cls)
+        obj._row = row if len(row) >= len(cls._fields) else tuple(row) + cls._padding[len(row):]
+        return obj
+
+    @classmethod
+    def from_rows(cls, rows):
+        return [cls.from_row(row) for row in rows]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key not in self._index:
+                raise KeyError(key)
+            return self._row[self._index[key]]
+        return self._row[key]
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self._row) == tuple(other._row)
+
+    def __hash__(self):
+        return hash((type(self), tuple(self._row)))
+
+    def _asdict(self):
+        return dict(zip(self._fields, self._row))
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={value!r}' for name, value in zip(self._fields, self._row))
+        return f'{type(self).__name__}({values})'
@@ -0,0 +1,30 @@
+import re
+
+# Matches "quoted phrases" and bare words (with an optional trailing * for prefix search)
+_TOKEN = re.compile(r'"([^"]*)"|(\S+)')
+_WORD = re.compile(r'\w+')
+
+
+def build_tsquery(search):
+    """
+    Turns free text typed into the search box into a to_tsquery() expression
+    over Products.search_vector. Every word must match; "quoted words" must
+    appear next to each other in that order, and a word ending in * matches
+    any word it is a prefix of:
+
+    >>> build_tsquery('red "coffee mug" cera*')
+    'red & (coffee <-> mug) & cera:*'
+
+    Punctuation is dropped, so user input cannot inject tsquery operators.
+    Returns None if nothing searchable is left.
+    """
+    terms = []
+    for phrase, word in _TOKEN.findall(search):
+        # A bare word that splits into several (x-ray, o'neil) is a phrase too
+        words = _WORD.findall(phrase or word)
+        if not words:
+            continue
+        if not phrase and word.endswith('*'):
+            words[-1] += ':*'
+        terms.append(words[0] if len(words) == 1 else '(' + ' <-> '.join(words) + ')')
+    return ' & '.join(terms) or None
@@ -0,0 +1,112 @@
+from threading import Event, Thread
+from flask import current_app as app
+
+
+class InventoryHolds:
+    """
+    Time-limited reservations of stock by carts. Adding a line to a cart (or
+    changing its quantity) holds that quantity of the seller's stock for
+    Config.INVENTORY_HOLD_TTL seconds, so other buyers cannot take it before
+    checkout. A hold is a row of InventoryHolds per cart line; the stock a
+    cart may take is the on-hand product_quantity minus the unexpired holds
+    of the other carts. Expired holds simply stop counting, and HoldSweeper
+    deletes them in the background.
+
+    Writers serialize per offer on the Products row lock (see available())
+    rather than on serialization failures, so concurrent buyers of one
+    product queue for a few milliseconds instead of aborting and retrying.
+    """
+
+    @staticmethod
+    def available(product_id, seller_id, order_id=None):
+        """
+        Locks the offer's Products row until the transaction ends and returns
+        its on-hand quantity minus the active holds of carts other than
+        order_id, or None if there is no such offer. Holds taken while the lock
+        is held are consistent with the returned quantity.
+        """
+        rows = app.db.execute('''
+        SELECT product_quantity
+        FROM Products
+        WHERE product_id = :product_id AND seller_id = :seller_id
+        FOR UPDATE
+        ''', product_id=product_id, seller_id=seller_id)
+        if not rows:
+            return None
+        # A statement of its own, so that (at READ COMMITTED) it sees the
+        # holds committed by whoever held the lock before us
+        held = app.db.execute('''
+        SELECT COALESCE(SUM(quantity), 0)
+        FROM InventoryHolds
+        WHERE product_id = :product_id AND seller_id = :seller_id
+          AND order_id IS DISTINCT FROM :order_id
+          AND expires_at > (current_timestamp AT TIME ZONE 'UTC')
+        ''', product_id=product_id, seller_id=seller_id, order_id=order_id)[0][0]
+        return rows[0][0] - held
+
+    @staticmethod
+    def hold(order_id, product_id, seller_id, quantity):
+        """Holds quantity of the offer for the cart line (replacing its previous
+        hold) for another INVENTORY_HOLD_TTL seconds. Call available() first, in
+        the same transaction."""
+        app.db.execute('''
+        INSERT INTO InventoryHolds (order_id, product_id, seller_id, quantity, expires_at)
+        VALUES (:order_id, :product_id, :seller_id, :quantity,
+                (current_timestamp AT TIME ZONE 'UTC') + make_interval(secs => :ttl))
+        ON CONFLICT (order_id, product_id, seller_id) DO UPDATE
+        SET quantity = EXCLUDED.quantity, expires_at = EXCLUDED.expires_at
+        ''', order_id=order_id, product_id=product_id, seller_id=seller_id, quantity=quantity,
+            ttl=app.config['INVENTORY_HOLD_TTL'])
+
+    @staticmethod
+    def release(order_id):
+        """Drops the holds of a cart, e.g. once its lines are bought."""
+        app.db.execute('''
+        DELETE FROM InventoryHolds WHERE order_id = :order_id
+        ''', order_id=order_id)
+
+    @staticmethod
+    def delete_expired(limit=1000):
+        """Deletes up to limit expired holds; returns how many were deleted."""
+        return app.db.execute('''
+        DELETE FROM InventoryHolds
+        WHERE ctid IN (SELECT ctid FROM InventoryHolds
+                       WHERE expires_at <= (current_timestamp AT TIME ZONE 'UTC')
+                       LIMIT :limit
+                       FOR UPDATE SKIP LOCKED)
+        ''', limit=limit)
+
+
+class HoldSweeper(Thread):
+    """Deletes expired inventory holds every interval seconds, in batches, so
+    the holds table stays as small as the number of live carts."""
+
+    def __init__(self, app, interval, batch_size=1000):
+        super().__init__(name='inventory-hold-sweeper', daemon=True)
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stopped = Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                self.app.logger.warning(f"Inventory hold sweep failed: {str(e)}")
+
+    def sweep(self):
+        """Runs one sweep; returns the number of holds deleted."""
+        total = 0
+        with self.app.app_context():
+            while not self._stopped.is_set():
+                deleted = InventoryHolds.delete_expired(self.batch_size)
+                total += deleted
+                if deleted < self.batch_size:
+                    break
+        if total:
+            self.app.logger.info(f"Deleted {total} expired inventory holds")
+        return total
@@ -1,17 +1,26 @@
 from flask import current_app as app
 from app.models.orders import Order
-from app.models.helpers.db_exceptions_wrapper import handle_db_exceptions
-
-class InventoryItems:
-    def __init__(self, product_id, product_name, product_quantity, product_price=None, available=True, category=None, description=None, image=None):
-        self.product_id = product_id
-        self.product_name = product_name
-        self.product_quantity = product_quantity
-        self.product_price = product_price
-        self.available = available
-        self.description = description
-        self.image = image
-        self.category = category
+from app.models.product_offers import ProductOffers
+from app.models.product_stats import ProductStats
+from app.models.seller_sales import SellerSales
+from app.models.helpers.db_exceptions_wrapper import handle_db_exceptions, retry_transaction
+from app.models.helpers.cache import cached, invalidate
+from app.models.helpers.db_pool import use_pool
+from app.models.helpers.pagination import cached_count
+from app.models.helpers.row_model import RowModel
+
+class SellerOffer(RowModel):
+    """One seller's stock and price for a product."""
+    __slots__ = ()
+    _fields = ('seller_id', 'product_quantity', 'price')
+
+
+class InventoryItems(RowModel):
+    __slots__ = ()
+    _fields = ('product_id', 'product_name', 'product_quantity', 'product_price',
+               'available', 'category', 'description', 'image')
+    _defaults = {'product_price': None, 'available': True, 'category': None,
+                 'description': None, 'image': None}
     
     # Fetch all products given a seller ID
     @staticmethod
@@ -22,21 +31,23 @@ class InventoryItems:
             WHERE p.seller_id = :seller_id AND p.available = TRUE
             ORDER BY p.product_id ASC
         ''', seller_id=seller_id)
-        items_in_inventory = [InventoryItems(row[0], row[1], row[2], row[3], row[4]) for row in rows]
-        return items_in_inventory
+        return InventoryItems.from_rows(rows)
     
     # Fetch the seller ID and quantity given a product ID    
     @staticmethod
+    @cached(lambda product_id: ('product', product_id))
+    @use_pool('catalog')
     def get_all_by_product(product_id):
         rows = app.db.execute('''
         SELECT p.seller_id, p.product_quantity, p.price
             FROM Products p
             WHERE p.product_id = :product_id
         ''', product_id=product_id)
-        return [{"seller_id": row[0], "product_quantity": row[1], "price": row[2]} for row in rows]
+        return SellerOffer.from_rows(rows)
 
     #Updates the details of a product in the seller's inventory.
     @staticmethod
+    @retry_transaction
     def update_inventory_item(seller_id, product_id, product_name, product_quantity, product_price, product_category, product_description, product_image):
         app.db.execute('''
             UPDATE Products
@@ -50,6 +61,7 @@ class InventoryItems:
         ''', product_name=product_name, product_quantity=product_quantity, product_price=product_price,
             product_category=product_category, product_description=product_description,
             product_image=product_image, product_id=product_id, seller_id=seller_id)
+        InventoryItems.product_changed(seller_id, product_id)
 
     # Fetch detailed information for a specific product in the seller's inventory
     @staticmethod
@@ -61,43 +73,35 @@ class InventoryItems:
         WHERE p.seller_id = :seller_id AND p.product_id = :product_id
         ''', seller_id=seller_id, product_id=product_id)
 
-        if row:
-            row = row[0]  # Get the first (and only) row from the results
-            return InventoryItems(
-                product_id=row[0],
-                product_name=row[1],
-                product_quantity=row[2],
-                product_price=row[3],
-                available=row[4],
-                category=row[5],
-                description=row[6],
-                image=row[7]
-            )
-        else:
-            return None
+        return InventoryItems.from_row(row[0]) if row else None
 
 
 
     # Update the quantity of a specific product in the seller's inventory
     @staticmethod
+    @retry_transaction
     def update_inventory_item_quantity(seller_id, product_id, new_quantity):
         app.db.execute('''
         UPDATE Products
         SET product_quantity = :new_quantity
         WHERE seller_id = :seller_id AND product_id = :product_id
         ''', seller_id=seller_id, product_id=product_id, new_quantity=new_quantity)
+        InventoryItems.product_changed(seller_id, product_id)
 
     # Update the price of a specific product in the seller's inventory
     @staticmethod
+    @retry_transaction
     def update_inventory_item_price(seller_id, product_id, new_price):
         app.db.execute('''
         UPDATE Products
         SET price = :new_price
         WHERE seller_id = :seller_id AND product_id = :product_id
         ''', seller_id=seller_id, product_id=product_id, new_price=new_price)
+        InventoryItems.product_changed(seller_id, product_id)
 
     #Delete a product from a seller's inventory
     @staticmethod
+    @retry_transaction
     def delete_inventory_item(seller_id, product_id):
         """
         Marks a specific product as unavailable in the seller's inventory instead of deleting it.
@@ -120,6 +124,7 @@ class InventoryItems:
         SET available = FALSE
         WHERE seller_id = :seller_id AND product_id = :product_id
         ''', seller_id=seller_id, product_id=product_id)
+        InventoryItems.product_changed(seller_id, product_id)
 
     #Add a new product to a specific seller's inventory
     @staticmethod
@@ -141,10 +146,13 @@ class InventoryItems:
             raise ValueError(f"A product with the name '{product_name}' already exists in your inventory.")
 
         # If no duplicate, proceed to add the product
-        app.db.execute('''
+        rows = app.db.execute('''
         INSERT INTO Products (product_name, price, available, seller_id, product_quantity)
         VALUES (:product_name, :product_price, TRUE, :seller_id, :product_quantity)
+        RETURNING product_id
         ''', product_name=product_name, product_price=product_price, seller_id=seller_id, product_quantity=product_quantity)
+        ProductStats.create(rows[0][0])
+        InventoryItems.product_changed(seller_id, rows[0][0])
 
 
     #Helper function to show products in a paginated format
@@ -158,21 +166,29 @@ class InventoryItems:
             ORDER BY p.product_id ASC
             LIMIT :items_per_page OFFSET :offset
         ''', seller_id=seller_id, items_per_page=items_per_page, offset=offset)
-        items_in_inventory = [InventoryItems(row[0], row[1], row[2], row[3], row[4]) for row in rows]
-        return items_in_inventory
+        return InventoryItems.from_rows(rows)
     
     #Helper method to count how many products a seller has to help with pagination
     @staticmethod
     def get_count_by_user(seller_id):
-        row = app.db.execute('''
+        # Cached until the seller's inventory changes (see product_changed)
+        return cached_count(('inventory', seller_id), '''
         SELECT COUNT(*)
             FROM Products p
             WHERE p.seller_id = :seller_id AND p.available = TRUE
         ''', seller_id=seller_id)
-        return row[0][0] if row else 0
+
+    @staticmethod
+    def product_changed(seller_id, product_id):
+        """Brings the product's offer summary up to date after a change to
+        seller_id's offer of product_id, and drops the cached product data and
+        listing counts the change can affect."""
+        ProductOffers.refresh(product_id)
+        invalidate(('product', product_id), 'categories', 'products', ('inventory', seller_id))
 
     #Fetch all orders given a seller ID
     @staticmethod
+    @use_pool('analytics')
     def get_seller_orders(seller_id, page, per_page):
         """
         Retrieves paginated orders for products sold by a given seller.
@@ -187,10 +203,11 @@ class InventoryItems:
             ORDER BY o.created_at DESC
             LIMIT :per_page OFFSET :offset
         ''', seller_id=seller_id, per_page=per_page, offset=offset)
-        return [Order(row[0], row[1], row[2], row[3]) for row in rows]
+        return Order.from_rows(rows)
 
     #Helper method to count how many orders a seller has to help with pagination
     @staticmethod
+    @use_pool('analytics')
     def count_seller_orders(seller_id):
         """
         Counts the total number of orders for products sold by a given seller.
@@ -205,36 +222,20 @@ class InventoryItems:
     
     #Fetch top 3 popular products for a given seller ID
     @staticmethod
+    @use_pool('analytics')
     def get_top_most_popular_products(seller_id, limit=3):
         """
-        Retrieves the top N most popular products for a seller.
+        Retrieves the top N most popular products for a seller, from the
+        seller's sales rollup.
         """
-        rows = app.db.execute('''
-        SELECT p.product_id, p.product_name, SUM(cp.quantity) AS total_quantity
-        FROM CartProducts cp
-        JOIN Products p ON cp.product_id = p.product_id
-        WHERE p.seller_id = :seller_id
-        GROUP BY p.product_id, p.product_name
-        ORDER BY total_quantity DESC
-        LIMIT :limit
-        ''', seller_id=seller_id, limit=limit)
-        
-        return [{"product_id": row[0], "product_name": row[1], "quantity_ordered": row[2]} for row in rows]
+        return SellerSales.top(seller_id, limit)
 
     #Fetch 3 least popular products for a given seller ID
     @staticmethod
+    @use_pool('analytics')
     def get_top_least_popular_products(seller_id, limit=3):
         """
-        Retrieves the top N least popular products for a seller.
+        Retrieves the top N least popular products for a seller, from the
+        seller's sales rollup.
         """
-        rows = app.db.execute('''
-        SELECT p.product_id, p.product_name, SUM(cp.quantity) AS total_quantity
-        FROM CartProducts cp
-        JOIN Products p ON cp.product_id = p.product_id
-        WHERE p.seller_id = :seller_id
-        GROUP BY p.product_id, p.product_name
-        ORDER BY total_quantity ASC
-        LIMIT :limit
-        ''', seller_id=seller_id, limit=limit)
-        
-        return [{"product_id": row[0], "product_name": row[1], "quantity_ordered": row[2]} for row in rows]
+        return SellerSales.top(seller_id, limit, ascending=True)
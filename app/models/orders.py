@@ -1,27 +1,37 @@
 from flask import current_app
 from app.models.helpers.db_exceptions_wrapper import handle_db_exceptions
+from app.models.helpers.db_pool import use_pool
+from app.models.helpers.jobs import enqueue, job
+from app.models.helpers.pagination import cached_count, window_count
+from app.models.helpers.row_model import RowModel
+from app.models.seller_order_status import SellerOrderStatus
 from app.models.user import User
 
 
-class Order:
+class OrderItem(RowModel):
+    """A line of an order: one product bought from one seller."""
+    __slots__ = ()
+    _fields = ("product_name", "quantity", "unit_price", "product_id", "fulfillment_status", "seller_id")
+    _defaults = {"seller_id": None}
+
+
+# Columns of the order history exports (see Order.stream_seller_lines and
+# Order.stream_buyer_lines), in the order their queries select them
+SELLER_EXPORT_COLUMNS = ("order_id", "created_at", "product_id", "product_name", "quantity",
+                         "unit_price", "line_total", "fulfillment_status", "coupon_code")
+BUYER_EXPORT_COLUMNS = ("order_id", "created_at", "product_id", "product_name", "seller_id",
+                        "quantity", "unit_price", "line_total", "fulfillment_status",
+                        "order_total", "coupon_code")
+
+
+class Order(RowModel):
     """
     This class represents a user's completed order. It provides methods to retrieve
     order summaries and detailed order information.
     """
-
-    def __init__(
-        self,
-        order_id,
-        total_price,
-        created_at,
-        coupon_code=None,
-        fulfillment_status="Incomplete",
-    ):
-        self.order_id = order_id
-        self.total_price = total_price
-        self.created_at = created_at
-        self.coupon_code = coupon_code
-        self.fulfillment_status = fulfillment_status
+    __slots__ = ()
+    _fields = ("order_id", "total_price", "created_at", "coupon_code", "fulfillment_status", "seller_ids")
+    _defaults = {"coupon_code": None, "fulfillment_status": "Incomplete", "seller_ids": None}
 
     @staticmethod
     @handle_db_exceptions
@@ -48,29 +58,20 @@ class Order:
         rows = current_app.db.execute(
             sql, user_id=user_id, per_page=per_page, offset=offset
         )
-        return [
-            {
-                "order_id": row[0],
-                "total_price": row[1],
-                "created_at": row[2],
-                "coupon_code": row[3],
-                "fulfillment_status": row[4],
-                "seller_ids": row[5]  # List of seller IDs
-            }
-            for row in rows
-        ]
+        return Order.from_rows(rows)
 
     @staticmethod
     @handle_db_exceptions
     def count_orders(user_id) -> int:
-        """Counts the total number of orders for a given user."""
-        result = current_app.db.execute(
+        """Counts the total number of orders for a given user.
+        Cached until the user's next checkout (see CartSubmission.submit_cart)."""
+        return cached_count(
+            ("orders", user_id),
             """
             SELECT COUNT(*) FROM Orders WHERE user_id = :user_id
             """,
             user_id=user_id,
         )
-        return result[0][0] if result else 0
 
     @staticmethod
     @handle_db_exceptions
@@ -90,11 +91,7 @@ class Order:
             user_id=user_id,
             order_id=order_id,
         )
-        if rows:
-            row = rows[0]
-            return Order(row[0], row[1], row[2], row[3], row[4])
-        else:
-            return None
+        return Order.from_row(rows[0]) if rows else None
 
     @staticmethod
     @handle_db_exceptions
@@ -105,7 +102,8 @@ class Order:
         offset = (page - 1) * per_page
         rows = current_app.db.execute(
             """
-            SELECT p.product_name, cp.quantity, cp.unit_price, cp.product_id, cp.fulfillment_status, cp.seller_id
+            SELECT p.product_name, cp.quantity, cp.unit_price, cp.product_id, cp.fulfillment_status, cp.seller_id,
+                   COUNT(*) OVER () AS total_items
             FROM CartProducts cp
             JOIN Products p ON cp.product_id = p.product_id AND cp.seller_id = p.seller_id
             WHERE cp.order_id = :order_id
@@ -116,41 +114,21 @@ class Order:
             offset=offset,
         )
 
-        total_items = current_app.db.execute(
+        total_items = window_count(rows, lambda: current_app.db.execute(
             """
             SELECT COUNT(*)
             FROM CartProducts
             WHERE order_id = :order_id
             """,
             order_id=order_id,
-        )[0][0]
-
-        order_items = []
-        for row in rows:
-            (
-                product_name,
-                quantity,
-                unit_price,
-                product_id,
-                fulfillment_status,
-                seller_id,
-            ) = row
-            order_items.append(
-                {
-                    "product_name": product_name,
-                    "quantity": quantity,
-                    "unit_price": unit_price,
-                    "product_id": product_id,
-                    "fulfillment_status": fulfillment_status,
-                    "seller_id": seller_id,
-                }
-            )
-
-        return order_items, total_items
+        )[0][0])
+
+        return OrderItem.from_rows(rows), total_items
 
 
     @staticmethod
     @handle_db_exceptions
+    @use_pool('analytics')
     def get_seller_orders(seller_id, page=1, per_page=5):
         """
         Retrieves paginated lists of orders involving products sold by the seller.
@@ -163,8 +141,9 @@ class Order:
             """
             SELECT 
                 o.order_id,
-                o.created_at,
                 SUM(cp.quantity * cp.unit_price) AS total_price,
+                o.created_at,
+                o.coupon_code,
                 o.fulfillment_status
             FROM Orders o
             JOIN CartProducts cp ON o.order_id = cp.order_id
@@ -184,8 +163,9 @@ class Order:
             """
             SELECT 
                 o.order_id,
-                o.created_at,
                 SUM(cp.quantity * cp.unit_price) AS total_price,
+                o.created_at,
+                o.coupon_code,
                 o.fulfillment_status
             FROM Orders o
             JOIN CartProducts cp ON o.order_id = cp.order_id
@@ -200,132 +180,69 @@ class Order:
             offset=offset,
         )
 
-        unfulfilled_orders = [
-            {
-                "order_id": row[0],
-                "created_at": row[1],
-                "total_price": row[2],
-                "fulfillment_status": row[3],
-            }
-            for row in unfulfilled_rows
-        ]
-        fulfilled_orders = [
-            {
-                "order_id": row[0],
-                "created_at": row[1],
-                "total_price": row[2],
-                "fulfillment_status": row[3],
-            }
-            for row in fulfilled_rows
-        ]
-
-        return unfulfilled_orders, fulfilled_orders
+        return Order.from_rows(unfulfilled_rows), Order.from_rows(fulfilled_rows)
 
     @staticmethod
     @handle_db_exceptions
+    @use_pool('analytics')
     def get_paginated_seller_orders(seller_id, statuses, page, per_page):
         """
-        Retrieves paginated lists of orders involving products sold by the seller.
+        Retrieves paginated lists of orders involving products sold by the seller,
+        with the seller's subtotal and status, for the seller's status(es) given.
+        Each status is a range of the SellerOrderStatus index, newest first.
         """
         offset = (page - 1) * per_page
-
-        # Prepare statuses for SQL query
-        if isinstance(statuses, list):
-            status_placeholder = ",".join(f"'{s}'" for s in statuses)
-        else:
-            status_placeholder = f"'{statuses}'"
-
-        sql = f"""
-            SELECT 
-                o.order_id,
-                o.created_at,
-                SUM(cp.quantity * cp.unit_price) AS total_price,
-                CASE 
-                    WHEN COUNT(*) = SUM(CASE WHEN cp.fulfillment_status = 'Fulfilled' THEN 1 ELSE 0 END) 
-                    THEN 'Fulfilled' 
-                    ELSE 'Incomplete' 
-                END AS seller_fulfillment_status
-            FROM Orders o
-            JOIN CartProducts cp ON o.order_id = cp.order_id
-            WHERE cp.seller_id = :seller_id
-            GROUP BY o.order_id, o.created_at
-            HAVING CASE 
-                        WHEN COUNT(*) = SUM(CASE WHEN cp.fulfillment_status = 'Fulfilled' THEN 1 ELSE 0 END) 
-                        THEN 'Fulfilled' 
-                        ELSE 'Incomplete' 
-                END IN ({status_placeholder})
-            ORDER BY o.created_at DESC
-            LIMIT :per_page OFFSET :offset
-        """
+        if not isinstance(statuses, list):
+            statuses = [statuses]
+        status_params = {f"status_{i}": status for i, status in enumerate(statuses)}
+        status_placeholder = ", ".join(f":{name}" for name in status_params)
 
         rows = current_app.db.execute(
-            sql, seller_id=seller_id, per_page=per_page, offset=offset
+            f"""
+            SELECT order_id, subtotal AS total_price, created_at, NULL AS coupon_code,
+                   status AS seller_fulfillment_status, NULL AS seller_ids,
+                   COUNT(*) OVER () AS total_items
+            FROM SellerOrderStatus
+            WHERE seller_id = :seller_id AND status IN ({status_placeholder})
+            ORDER BY created_at DESC, order_id DESC
+            LIMIT :per_page OFFSET :offset
+            """,
+            seller_id=seller_id, per_page=per_page, offset=offset, **status_params
         )
 
-        total_items = current_app.db.execute(
+        # An empty page past the end falls back to counting separately
+        total_items = window_count(rows, lambda: current_app.db.execute(
             f"""
             SELECT COUNT(*)
-            FROM (
-                SELECT 
-                    o.order_id
-                FROM Orders o
-                JOIN CartProducts cp ON o.order_id = cp.order_id
-                WHERE cp.seller_id = :seller_id
-                GROUP BY o.order_id
-                HAVING CASE 
-                            WHEN COUNT(*) = SUM(CASE WHEN cp.fulfillment_status = 'Fulfilled' THEN 1 ELSE 0 END) 
-                            THEN 'Fulfilled' 
-                            ELSE 'Incomplete' 
-                    END IN ({status_placeholder})
-            ) AS subquery
+            FROM SellerOrderStatus
+            WHERE seller_id = :seller_id AND status IN ({status_placeholder})
             """,
-            seller_id=seller_id,
-        )[0][0]
+            seller_id=seller_id, **status_params
+        )[0][0])
 
-        orders = [
-            {
-                "order_id": row[0],
-                "created_at": row[1],
-                "total_price": row[2],
-                "fulfillment_status": row[3], 
-            }
-            for row in rows
-        ]
-        return orders, total_items
+        return Order.from_rows(rows), total_items
 
 
     @staticmethod
     @handle_db_exceptions
     def get_order_by_seller(seller_id, order_id) -> "Order":
         """
-        Retrieves orders involving products sold by the seller.
+        Retrieves an order involving products sold by the seller, with the
+        seller's subtotal and status.
         """
         rows = current_app.db.execute(
             """
-            SELECT 
-                o.order_id, 
-                SUM(cp.quantity * cp.unit_price) AS total_price, 
-                o.created_at, 
-                o.coupon_code, 
-                CASE 
-                    WHEN COUNT(*) = SUM(CASE WHEN cp.fulfillment_status = 'Fulfilled' THEN 1 ELSE 0 END) 
-                    THEN 'Fulfilled' 
-                    ELSE 'Incomplete' 
-                END AS seller_fulfillment_status
-            FROM Orders o
-            JOIN CartProducts cp ON o.order_id = cp.order_id
-            WHERE cp.seller_id = :seller_id AND o.order_id = :order_id
-            GROUP BY o.order_id, o.created_at, o.coupon_code
+            SELECT s.order_id, s.subtotal AS total_price, s.created_at, o.coupon_code,
+                   s.status AS seller_fulfillment_status
+            FROM SellerOrderStatus s
+            JOIN Orders o ON o.order_id = s.order_id
+            WHERE s.seller_id = :seller_id AND s.order_id = :order_id
             """,
             seller_id=seller_id,
             order_id=order_id,
         )
 
-        if rows:
-            row = rows[0]
-            return Order(row[0], row[1], row[2], row[3], fulfillment_status=row[4])
-        else:
-            return None
+        return Order.from_row(rows[0]) if rows else None
 
 
     @staticmethod
@@ -337,7 +254,8 @@ class Order:
         offset = (page - 1) * per_page
         rows = current_app.db.execute(
             """
-            SELECT p.product_name, cp.quantity, cp.unit_price, cp.product_id, cp.fulfillment_status
+            SELECT p.product_name, cp.quantity, cp.unit_price, cp.product_id, cp.fulfillment_status, cp.seller_id,
+                   COUNT(*) OVER () AS total_items
             FROM CartProducts cp
             JOIN Products p ON cp.product_id = p.product_id AND cp.seller_id = p.seller_id
             WHERE cp.seller_id = :seller_id AND cp.order_id = :order_id
@@ -349,7 +267,7 @@ class Order:
             offset=offset,
         )
 
-        total_items = current_app.db.execute(
+        total_items = window_count(rows, lambda: current_app.db.execute(
             """
             SELECT COUNT(*)
             FROM CartProducts
@@ -357,23 +275,68 @@ class Order:
             """,
             seller_id=seller_id,
             order_id=order_id,
-        )[0][0]
+        )[0][0])
+
+        return OrderItem.from_rows(rows), total_items
 
-        order_items = []
-        for row in rows:
-            product_name, quantity, unit_price, product_id, fulfillment_status = row
-            order_items.append(
-                {
-                    "product_name": product_name,
-                    "quantity": quantity,
-                    "unit_price": unit_price,
-                    "product_id": product_id,
-                    "fulfillment_status": fulfillment_status,
-                }
-            )
 
-        return order_items, total_items
+    @staticmethod
+    @use_pool('export')
+    def stream_seller_lines(seller_id, start=None, end=None, batch_size=5000):
+        """
+        Streams every item the seller sold in orders created in [start, end)
+        (either bound may be None), in batches of batch_size rows of
+        SELLER_EXPORT_COLUMNS, oldest order first. Rows are read from a
+        server-side cursor as the batches are consumed (see DB.stream).
+        """
+        return current_app.db.stream(
+            """
+            SELECT s.order_id, s.created_at, cp.product_id, p.product_name, cp.quantity,
+                   cp.unit_price, cp.quantity * cp.unit_price AS line_total,
+                   cp.fulfillment_status, o.coupon_code
+            FROM SellerOrderStatus s
+            JOIN Orders o ON o.order_id = s.order_id
+            JOIN CartProducts cp ON cp.order_id = s.order_id AND cp.seller_id = s.seller_id
+            JOIN Products p ON p.product_id = cp.product_id AND p.seller_id = cp.seller_id
+            WHERE s.seller_id = :seller_id
+              AND (CAST(:start AS TIMESTAMP) IS NULL OR s.created_at >= :start)
+              AND (CAST(:end AS TIMESTAMP) IS NULL OR s.created_at < :end)
+            ORDER BY s.order_id, cp.product_id
+            """,
+            batch_size=batch_size,
+            batches=True,
+            seller_id=seller_id,
+            start=start,
+            end=end,
+        )
 
+    @staticmethod
+    @use_pool('export')
+    def stream_buyer_lines(user_id, start=None, end=None, batch_size=5000):
+        """
+        Streams every item of the user's orders created in [start, end)
+        (either bound may be None), in batches of batch_size rows of
+        BUYER_EXPORT_COLUMNS, oldest order first, like stream_seller_lines.
+        """
+        return current_app.db.stream(
+            """
+            SELECT o.order_id, o.created_at, cp.product_id, p.product_name, cp.seller_id,
+                   cp.quantity, cp.unit_price, cp.quantity * cp.unit_price AS line_total,
+                   cp.fulfillment_status, o.total_price AS order_total, o.coupon_code
+            FROM Orders o
+            JOIN CartProducts cp ON cp.order_id = o.order_id
+            JOIN Products p ON p.product_id = cp.product_id AND p.seller_id = cp.seller_id
+            WHERE o.user_id = :user_id
+              AND (CAST(:start AS TIMESTAMP) IS NULL OR o.created_at >= :start)
+              AND (CAST(:end AS TIMESTAMP) IS NULL OR o.created_at < :end)
+            ORDER BY o.created_at, o.order_id, cp.product_id
+            """,
+            batch_size=batch_size,
+            batches=True,
+            user_id=user_id,
+            start=start,
+            end=end,
+        )
 
     @staticmethod
     @handle_db_exceptions
@@ -400,76 +363,107 @@ class Order:
     def update_item_fulfillment_status(order_id, product_id, seller_id, new_status):
         """
         Updates the fulfillment status of an individual item in the order and 
-        recalculates the overall order fulfillment status.
+        queues the recalculation of the overall order fulfillment status.
         Ensures the database is updated and changes are committed.
         """
-        # Define allowed statuses
-        allowed_statuses = ["Incomplete", "Fulfilled"]
-        if new_status not in allowed_statuses:
-            raise ValueError("Invalid fulfillment status. Must be 'Incomplete' or 'Fulfilled'.")
+        return Order.update_items_fulfillment_status(seller_id, [(order_id, product_id)], new_status)
+
+    @staticmethod
+    @handle_db_exceptions
+    def update_items_fulfillment_status(seller_id, items, new_status):
+        """
+        Updates the fulfillment status of many of the seller's items, given as
+        (order_id, product_id) pairs, in one transaction: either all of them
+        change or, if one is not the seller's, none does. The seller's statuses
+        of the orders are recounted in the same transaction, and the overall
+        fulfillment status of all of the orders is recalculated by one job.
+        """
+        Order._check_fulfillment_status(new_status)
+        items = sorted(set(items))
+        if not items:
+            return "success"
 
-        # Update the fulfillment status of the specific item
-        rows_affected = current_app.db.execute(
+        updated = current_app.db.execute_many(
             """
-            UPDATE CartProducts
+            UPDATE CartProducts cp
             SET fulfillment_status = :new_status
-            WHERE order_id = :order_id AND product_id = :product_id AND seller_id = :seller_id
+            FROM (VALUES :values) AS v(order_id, product_id)
+            WHERE cp.order_id = v.order_id AND cp.product_id = v.product_id
+              AND cp.seller_id = :seller_id
+            RETURNING cp.order_id
             """,
-            order_id=order_id,
-            product_id=product_id,
+            items,
             seller_id=seller_id,
             new_status=new_status,
         )
 
-        # Check if any row was updated
-        if rows_affected == 0:
-            raise ValueError(f"No matching item found for Order ID: {order_id}, Product ID: {product_id}, Seller ID: {seller_id}.")
-
-        # Commit the changes to ensure persistence
-        current_app.db.commit()
-
-        # Recalculate the overall order fulfillment status
-        Order.recalculate_order_fulfillment_status(order_id)
-
-
+        # Check that every item was updated
+        if len(updated) != len(items):
+            raise ValueError(f"{len(items) - len(updated)} of the {len(items)} items are not items of Seller ID: {seller_id}.")
 
+        Order._fulfillment_changed(seller_id, {row[0] for row in updated})
+        return "success"
 
     @staticmethod
     @handle_db_exceptions
-    def recalculate_order_fulfillment_status(order_id):
+    def update_orders_fulfillment_status(seller_id, order_ids, new_status):
         """
-        Recalculates the overall fulfillment status of an order by checking the statuses
-        of all items in the order and updating the database accordingly.
+        Updates the fulfillment status of all of the seller's items in each of
+        order_ids in one transaction, like update_items_fulfillment_status.
+        Returns the number of items updated.
         """
-        # Fetch all item statuses for the order
-        item_statuses = current_app.db.execute(
+        Order._check_fulfillment_status(new_status)
+        updated = current_app.db.execute(
             """
-            SELECT fulfillment_status
-            FROM CartProducts
-            WHERE order_id = :order_id
+            UPDATE CartProducts
+            SET fulfillment_status = :new_status
+            WHERE order_id = ANY(CAST(:order_ids AS INT[])) AND seller_id = :seller_id
+            RETURNING order_id
             """,
-            order_id=order_id,
+            order_ids=sorted(set(order_ids)),
+            seller_id=seller_id,
+            new_status=new_status,
         )
+        Order._fulfillment_changed(seller_id, {row[0] for row in updated})
+        return len(updated)
 
-        # Extract the statuses into a list
-        item_statuses = [row[0] for row in item_statuses]
+    @staticmethod
+    def _check_fulfillment_status(new_status):
+        # Define allowed statuses
+        allowed_statuses = ["Incomplete", "Fulfilled"]
+        if new_status not in allowed_statuses:
+            raise ValueError("Invalid fulfillment status. Must be 'Incomplete' or 'Fulfilled'.")
 
-        # Determine the overall status:
-        # - 'Fulfilled' if all items are fulfilled
-        # - 'Incomplete' otherwise
-        overall_status = "Fulfilled" if all(status == "Fulfilled" for status in item_statuses) else "Incomplete"
+    @staticmethod
+    def _fulfillment_changed(seller_id, order_ids):
+        """Recounts the seller's statuses of order_ids, whose items' statuses
+        changed, and queues the recalculation of their overall statuses."""
+        if not order_ids:
+            return
+        order_ids = sorted(order_ids)
+        SellerOrderStatus.refresh(seller_id, *order_ids)
+        enqueue("recalculate_orders_status", order_ids=order_ids)
 
-        # Update the overall order status in the database
+    @staticmethod
+    @job("recalculate_orders_status")
+    def recalculate_orders_fulfillment_status(order_ids):
+        """
+        Recalculates the overall fulfillment status of each of order_ids in one
+        statement: 'Fulfilled' if all of its items are fulfilled, 'Incomplete'
+        otherwise. Orders whose status does not change are not written.
+        Run by the job worker after item statuses change.
+        """
         current_app.db.execute(
             """
-            UPDATE Orders
-            SET fulfillment_status = :overall_status
-            WHERE order_id = :order_id
+            UPDATE Orders o
+            SET fulfillment_status = s.overall_status
+            FROM (SELECT cp.order_id,
+                         CASE WHEN BOOL_AND(cp.fulfillment_status = 'Fulfilled')
+                              THEN 'Fulfilled' ELSE 'Incomplete' END AS overall_status
+                  FROM CartProducts cp
+                  WHERE cp.order_id = ANY(CAST(:order_ids AS INT[]))
+                  GROUP BY cp.order_id) AS s
+            WHERE o.order_id = s.order_id AND o.fulfillment_status <> s.overall_status
             """,
-            order_id=order_id,
-            overall_status=overall_status,
+            order_ids=list(order_ids),
         )
-
-        # Commit the changes to ensure the update is persisted
-        current_app.db.commit()
-
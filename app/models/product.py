@@ -1,35 +1,43 @@
 from flask import current_app as app
 from math import ceil
+from app.models.helpers.cache import cached
+from app.models.helpers.db_pool import use_pool
+from app.models.helpers.pagination import window_count
+from app.models.helpers.row_model import RowModel
 
-class Product:
-    def __init__(self, product_id, product_name, price, available, seller_id=None, product_quantity=1, description=None, image=None, category=None):
-        self.product_id = product_id
-        self.product_name = product_name
-        self.price = price
-        self.available = available
-        self.seller_id = seller_id
-        self.product_quantity = product_quantity
-        self.description = description
-        self.image = image
-        self.category = category
-        
+class Product(RowModel):
+    __slots__ = ()
+    _fields = ('product_id', 'product_name', 'price', 'available', 'seller_id',
+               'product_quantity', 'description', 'image', 'category')
+    _defaults = {'seller_id': None, 'product_quantity': 1, 'description': None,
+                 'image': None, 'category': None}
 
     @staticmethod
+    @cached(lambda product_id: ('product', product_id))
+    @use_pool('catalog')
     def get(product_id):
+        """The product as offered by its best seller (see ProductOffers), or by
+        its lowest seller_id if no seller has it in stock."""
         rows = app.db.execute('''
-        SELECT product_id, product_name, price, available, seller_id, product_quantity, description, image, category
-        FROM Products
-        WHERE product_id = :product_id
+        SELECT p.product_id, p.product_name, p.price, p.available, p.seller_id,
+               p.product_quantity, p.description, p.image, p.category
+        FROM Products p
+        LEFT JOIN ProductOffers o ON o.product_id = p.product_id
+        WHERE p.product_id = :product_id
+        ORDER BY p.seller_id IS DISTINCT FROM o.best_seller_id, p.seller_id
+        LIMIT 1
         ''',
                               product_id=product_id)
-        return Product(*(rows[0])) if rows is not None else None
+        return Product.from_row(rows[0]) if rows else None
 
     @staticmethod
+    @use_pool('catalog')
     def get_all(available=True, page=1, per_page=9):
         offset = (page - 1) * per_page
         rows = app.db.execute(
             '''
-            SELECT product_id, product_name, price, available, seller_id, product_quantity, description, image, category
+            SELECT product_id, product_name, price, available, seller_id, product_quantity, description, image, category,
+                   COUNT(*) OVER () AS total_count
             FROM Products
             WHERE available = :available
             LIMIT :per_page OFFSET :offset
@@ -39,17 +47,18 @@ class Product:
             offset=offset
         )
         
-        total_count = app.db.execute(
+        total_count = window_count(rows, lambda: app.db.execute(
             '''
             SELECT COUNT(*) FROM Products WHERE available = :available
             ''', 
             available=available
-        )[0][0]
+        )[0][0])
         
         total_pages = ceil(total_count / per_page)
-        return [Product(*row) for row in rows], total_pages
+        return Product.from_rows(rows), total_pages
 
     @staticmethod
+    @use_pool('catalog')
     def get_all_paginated(page, items_per_page, available=True):
         offset = (page - 1) * items_per_page
         rows = app.db.execute('''
@@ -59,9 +68,10 @@ class Product:
             LIMIT :items_per_page OFFSET :offset
         ''', available = available, items_per_page=items_per_page, offset=offset)
         #items_in_inventory = [InventoryItems(row[0], row[1], row[2]) for row in rows]
-        return [Product(*row) for row in rows]
+        return Product.from_rows(rows)
 
     @staticmethod
+    @use_pool('catalog')
     def get_count_products(available=True):
         row = app.db.execute('''
         SELECT COUNT(*)
@@ -72,6 +82,7 @@ class Product:
 
 
     @staticmethod
+    @use_pool('catalog')
     def get_top_k_expensive(k):
         rows = app.db.execute('''
         SELECT product_id, product_name, price, available, seller_id, product_quantity, description, image, category
@@ -80,4 +91,14 @@ class Product:
             LIMIT :k
             ''',
                                  k=k)
-        return [Product(*row) for row in rows]
+        return Product.from_rows(rows)
+
+    @staticmethod
+    @cached(lambda: 'categories')
+    @use_pool('catalog')
+    def get_categories():
+        """Categories that have at least one product in stock, for the catalog filter."""
+        rows = app.db.execute('''
+        SELECT DISTINCT category FROM ProductOffers WHERE best_seller_id IS NOT NULL
+        ''')
+        return [row[0] for row in rows]
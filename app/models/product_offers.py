@@ -0,0 +1,69 @@
+from flask import current_app as app
+from app.models.helpers.row_model import RowModel
+
+
+class ProductOffers(RowModel):
+    """
+    Summary of the sellers' offers of a product: how many sellers offer it,
+    their total stock and price range, and the best offer, i.e. the cheapest
+    one in stock (lowest seller_id on a tie; None if nothing is in stock).
+    Withdrawn offers (available = FALSE) do not count. The rows are kept in
+    step with Products by refresh(), called in the transaction of every
+    Products write, so the catalog lists one row per product and filters and
+    sorts by price on an index instead of over every seller's row.
+    """
+    __slots__ = ()
+    _fields = ('product_id', 'seller_count', 'total_quantity', 'min_price', 'max_price',
+               'best_seller_id', 'best_price', 'category')
+
+    @staticmethod
+    def get(product_id):
+        rows = app.db.execute('''
+        SELECT product_id, seller_count, total_quantity, min_price, max_price,
+               best_seller_id, best_price, category
+        FROM ProductOffers
+        WHERE product_id = :product_id
+        ''', product_id=product_id)
+        return ProductOffers.from_row(rows[0]) if rows else None
+
+    @staticmethod
+    def refresh(*product_ids):
+        """Recomputes the summaries of product_ids from their Products rows.
+        Must run in the transaction that changes those rows."""
+        if not product_ids:
+            return
+        product_ids = sorted(set(product_ids))
+        # Lock the summaries first (in product_id order, so concurrent refreshes
+        # do not deadlock): at READ COMMITTED the recount below then starts after
+        # any concurrent refresh has committed, and sees its changes
+        app.db.execute('''
+        SELECT 1 FROM ProductOffers
+        WHERE product_id = ANY(CAST(:product_ids AS INT[]))
+        ORDER BY product_id
+        FOR UPDATE
+        ''', product_ids=product_ids)
+        app.db.execute('''
+        INSERT INTO ProductOffers (product_id, seller_count, total_quantity, min_price, max_price,
+                                   best_seller_id, best_price, category)
+        SELECT ids.product_id, COUNT(p.seller_id), COALESCE(SUM(p.product_quantity), 0),
+               MIN(p.price), MAX(p.price), best.seller_id, best.price, best.category
+        FROM unnest(CAST(:product_ids AS INT[])) AS ids(product_id)
+        LEFT JOIN Products p ON p.product_id = ids.product_id AND p.available
+        LEFT JOIN LATERAL (
+            SELECT b.seller_id, b.price, b.category
+            FROM Products b
+            WHERE b.product_id = ids.product_id AND b.available AND b.product_quantity > 0
+            ORDER BY b.price, b.seller_id
+            LIMIT 1
+        ) best ON TRUE
+        GROUP BY ids.product_id, best.seller_id, best.price, best.category
+        ORDER BY ids.product_id
+        ON CONFLICT (product_id) DO UPDATE
+        SET seller_count = EXCLUDED.seller_count,
+            total_quantity = EXCLUDED.total_quantity,
+            min_price = EXCLUDED.min_price,
+            max_price = EXCLUDED.max_price,
+            best_seller_id = EXCLUDED.best_seller_id,
+            best_price = EXCLUDED.best_price,
+            category = EXCLUDED.category
+        ''', product_ids=product_ids)
@@ -0,0 +1,89 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+from flask import current_app as app
+from app.models.helpers.cache import cached
+from app.models.helpers.db_pool import use_pool
+from app.models.helpers.row_model import RowModel
+from app.models.inventory_items import InventoryItems, SellerOffer
+from app.models.product import Product
+from app.models.product_stats import ProductStats
+from app.models.reviews import Reviews
+
+
+class ProductPage(RowModel):
+    """
+    Everything the product page shows: the product, every seller's offer,
+    the selected seller's inventory details, the latest reviews with their
+    authors' names and the rating stats, loaded in one statement.
+    """
+    __slots__ = ()
+    _fields = ('product', 'sellers', 'seller', 'reviews', 'stats')
+
+    @staticmethod
+    @cached(lambda product_id, seller_id=None, review_limit=10: ('product', product_id))
+    @use_pool('catalog')
+    def load(product_id, seller_id=None, review_limit=10):
+        """
+        Returns the ProductPage of product_id; product and seller are the best
+        offer (see Product.get), or seller is the detailed offer of seller_id
+        if given (None if seller_id does not sell it), and product is None if
+        the product does not exist. The offers, seller,
+        reviews and stats come back as JSON built by the same query, so they
+        cost no extra round trips.
+        """
+        rows = app.db.execute('''
+        SELECT p.product_id, p.product_name, p.price, p.available, p.seller_id,
+               p.product_quantity, p.description, p.image, p.category,
+               (SELECT json_agg(json_build_array(o.seller_id, o.product_quantity, o.price)
+                                ORDER BY o.seller_id)::TEXT
+                FROM Products o
+                WHERE o.product_id = p.product_id) AS sellers,
+               (SELECT json_build_array(s.product_id, s.product_name, s.product_quantity, s.price,
+                                        s.available, s.category, s.description, s.image)::TEXT
+                FROM Products s
+                WHERE s.product_id = p.product_id
+                  AND s.seller_id = COALESCE(CAST(:seller_id AS INT), p.seller_id)) AS seller,
+               (SELECT json_agg(json_build_array(r.review_id, r.user_id, r.seller_id, r.reviewer_type,
+                                                 r.product_id, r.stars, r.review_text, r.time_written,
+                                                 r.upvotes, r.firstname, r.lastname)
+                                ORDER BY r.time_written DESC)::TEXT
+                FROM (SELECT r.*, u.firstname, u.lastname
+                      FROM Reviews r
+                      JOIN Users u ON r.user_id = u.id
+                      WHERE r.product_id = p.product_id
+                      ORDER BY r.time_written DESC
+                      LIMIT :review_limit) r) AS reviews,
+               (SELECT json_build_array(ps.product_id, ps.review_count, ps.stars_sum, ps.stars_1,
+                                        ps.stars_2, ps.stars_3, ps.stars_4, ps.stars_5,
+                                        ps.average_rating)::TEXT
+                FROM ProductStats ps
+                WHERE ps.product_id = p.product_id) AS stats
+        FROM Products p
+        LEFT JOIN ProductOffers o ON o.product_id = p.product_id
+        WHERE p.product_id = :product_id
+        ORDER BY p.seller_id IS DISTINCT FROM o.best_seller_id, p.seller_id
+        LIMIT 1
+        ''', product_id=product_id, seller_id=seller_id, review_limit=review_limit)
+
+        if not rows:
+            return ProductPage(None, [], None, [], ProductStats(product_id, 0, 0, 0, 0, 0, 0, 0, 0))
+        row = rows[0]
+        reviews = []
+        for review in _from_json(row.reviews) or []:
+            review[7] = datetime.fromisoformat(review[7])
+            reviews.append(Reviews.from_row(review))
+        seller = _from_json(row.seller)
+        stats = _from_json(row.stats)
+        return ProductPage(
+            product=Product.from_row(row[:len(Product._fields)]),
+            sellers=[SellerOffer.from_row(offer) for offer in _from_json(row.sellers) or []],
+            seller=InventoryItems.from_row(seller) if seller else None,
+            reviews=reviews,
+            stats=ProductStats.from_row(stats) if stats else ProductStats(product_id, 0, 0, 0, 0, 0, 0, 0, 0),
+        )
+
+
+def _from_json(text):
+    # Parse numbers with a fraction as Decimal, as the driver does for NUMERIC columns
+    return json.loads(text, parse_float=Decimal) if text is not None else None
@@ -0,0 +1,65 @@
+from flask import current_app as app
+from app.models.helpers.cache import cached
+from app.models.helpers.row_model import RowModel
+
+
+class ProductStats(RowModel):
+    """
+    Review aggregates of a product: number of reviews, sum of stars and a
+    per-star histogram, with the average rating derived from them. The rows
+    are kept in step with Reviews by the Reviews write methods (in the same
+    transaction), so listings read ratings without aggregating Reviews.
+    """
+    __slots__ = ()
+    _fields = ('product_id', 'review_count', 'stars_sum', 'stars_1', 'stars_2',
+               'stars_3', 'stars_4', 'stars_5', 'average_rating')
+
+    @staticmethod
+    @cached(lambda product_id: ('reviews', product_id))
+    def get(product_id):
+        rows = app.db.execute('''
+        SELECT product_id, review_count, stars_sum, stars_1, stars_2, stars_3, stars_4, stars_5,
+               average_rating
+        FROM ProductStats
+        WHERE product_id = :product_id
+        ''', product_id=product_id)
+        return ProductStats.from_row(rows[0]) if rows else ProductStats(product_id, 0, 0, 0, 0, 0, 0, 0, 0)
+
+    @property
+    def histogram(self):
+        """Number of reviews per star rating, from 5 stars down to 1."""
+        return {stars: self[f'stars_{stars}'] for stars in range(5, 0, -1)}
+
+    @staticmethod
+    def create(product_id):
+        """Adds the (empty) stats row of a new product, so that it shows up in
+        listings that join ProductStats."""
+        app.db.execute('''
+        INSERT INTO ProductStats (product_id)
+        VALUES (:product_id)
+        ON CONFLICT (product_id) DO NOTHING
+        ''', product_id=product_id)
+
+    @staticmethod
+    def add_review(product_id, stars, delta=1):
+        """Counts a review of product_id with the given stars (delta=1), or
+        stops counting it (delta=-1). Must run in the transaction that writes
+        the review; the review's writer invalidates the cached stats. Reviews
+        without stars are not counted."""
+        if stars is None:
+            return
+        counts = {f'stars_{i}': delta if i == stars else 0 for i in range(1, 6)}
+        app.db.execute('''
+        INSERT INTO ProductStats (product_id, review_count, stars_sum,
+                                  stars_1, stars_2, stars_3, stars_4, stars_5)
+        VALUES (:product_id, :delta, :stars_sum,
+                :stars_1, :stars_2, :stars_3, :stars_4, :stars_5)
+        ON CONFLICT (product_id) DO UPDATE
+        SET review_count = ProductStats.review_count + EXCLUDED.review_count,
+            stars_sum = ProductStats.stars_sum + EXCLUDED.stars_sum,
+            stars_1 = ProductStats.stars_1 + EXCLUDED.stars_1,
+            stars_2 = ProductStats.stars_2 + EXCLUDED.stars_2,
+            stars_3 = ProductStats.stars_3 + EXCLUDED.stars_3,
+            stars_4 = ProductStats.stars_4 + EXCLUDED.stars_4,
+            stars_5 = ProductStats.stars_5 + EXCLUDED.stars_5
+        ''', product_id=product_id, delta=delta, stars_sum=delta * stars, **counts)
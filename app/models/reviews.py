@@ -1,47 +1,42 @@
 from flask import current_app as app
+from app.models.helpers.db_exceptions_wrapper import retry_transaction
+from app.models.helpers.cache import invalidate
+from app.models.helpers.row_model import RowModel
+from app.models.product_stats import ProductStats
+
+class Reviews(RowModel):
+    __slots__ = ()
+    _fields = ('review_id', 'user_id', 'seller_id', 'reviewer_type', 'product_id', 'stars',
+               'review_text', 'time_written', 'upvotes', 'firstname', 'lastname')
+    # Queries that do not join Users leave the reviewer's name empty
+    _defaults = {'firstname': None, 'lastname': None}
 
-class Reviews:
-    def __init__(self, review_id, user_id, seller_id, reviewer_type, product_id, stars, review_text, time_written, upvotes, firstname, lastname):
-        self.review_id = review_id
-        self.user_id = user_id
-        self.seller_id = seller_id
-        self.reviewer_type = reviewer_type
-        self.product_id = product_id
-        self.stars = stars
-        self.review_text = review_text
-        self.time_written = time_written
-        self.upvotes = upvotes
-        self.firstname = firstname
-        self.lastname = lastname
-
-    
     @staticmethod
     def get(review_id):
         rows = app.db.execute('''
-        SELECT review_id, user_id, product_id, stars, review_text, seller_id, reviewer_type, 
+        SELECT review_id, user_id, seller_id, reviewer_type, product_id, stars, review_text,
                time_written, upvotes
         FROM Reviews
         WHERE review_id = :review_id
         ''', review_id=review_id)
 
         # If a row is returned, create a Review object, otherwise return None
-        if rows:
-            # Add default values for missing firstname and lastname
-            return Reviews(*rows[0], firstname=None, lastname=None)  
-        return None
+        return Reviews.from_row(rows[0]) if rows else None
     
     @staticmethod
     def get_recent_feedback(user_id):
         rows = app.db.execute('''
-            SELECT review_id, user_id, reviewer_type, product_id, stars, review_text, time_written
+            SELECT review_id, user_id, seller_id, reviewer_type, product_id, stars, review_text,
+                   time_written, upvotes
             FROM Reviews
             WHERE user_id = :user_id
             ORDER BY time_written DESC
         ''', user_id=user_id)
-        return rows
+        return Reviews.from_rows(rows)
 
 
     @staticmethod
+    @retry_transaction
     def add_review(user_id, product_id, stars, review_text, seller_id):
         """Insert a new review into the Reviews table with reviewer_type set to 'buyer'."""
         result = app.db.execute('''
@@ -49,6 +44,8 @@ class Reviews:
             VALUES (:user_id, :product_id, :stars, :review_text, :seller_id, 'buyer', current_timestamp)
             RETURNING review_id
         ''', user_id=user_id, product_id=product_id, stars=stars, review_text=review_text, seller_id=seller_id)
+        ProductStats.add_review(product_id, stars)
+        invalidate(('reviews', product_id), ('product', product_id))
 
         # If the insert was successful
         return result[0][0] if result else None
@@ -69,63 +66,66 @@ class Reviews:
     @staticmethod
     def edit_review(review_id, stars, review_text):
         try:
-            app.db.execute('''
-                UPDATE Reviews
-                SET stars = :stars, review_text = :review_text, time_written = current_timestamp
-                WHERE review_id = :review_id
-            ''', review_id=review_id, stars=stars, review_text=review_text)
+            Reviews._update_review(review_id, stars, review_text)
             return True
         except Exception as e:
             print(str(e))
         return False
 
+    @staticmethod
+    @retry_transaction
+    def _update_review(review_id, stars, review_text):
+        rows = app.db.execute('''
+            UPDATE Reviews r
+            SET stars = :stars, review_text = :review_text, time_written = current_timestamp
+            FROM (SELECT review_id, stars FROM Reviews WHERE review_id = :review_id FOR UPDATE) old
+            WHERE r.review_id = old.review_id
+            RETURNING r.product_id, old.stars
+        ''', review_id=review_id, stars=stars, review_text=review_text)
+        if rows:
+            product_id, old_stars = rows[0]
+            invalidate(('reviews', product_id), ('product', product_id))
+            if old_stars != stars:
+                ProductStats.add_review(product_id, old_stars, delta=-1)
+                ProductStats.add_review(product_id, stars)
+
 
     @staticmethod
     def get_review_by_id(review_id):
         """Fetches a review by its ID."""
-        result = app.db.execute('''
-            SELECT * FROM Reviews WHERE review_id = :review_id
-        ''', review_id=review_id)
-        return result[0] if result else None
+        return Reviews.get(review_id)
 
     @staticmethod
+    @retry_transaction
     def delete_review(review_id):
         """Deletes a review by its ID."""
-        rows_deleted = app.db.execute('''
+        rows = app.db.execute('''
             DELETE FROM Reviews WHERE review_id = :review_id
+            RETURNING product_id, stars
         ''', review_id=review_id)
+        for product_id, stars in rows:
+            ProductStats.add_review(product_id, stars, delta=-1)
+            invalidate(('reviews', product_id), ('product', product_id))
         
         # Check if any rows were affected
-        return rows_deleted > 0
+        return len(rows) > 0
 
     @staticmethod
     def upvote_review(review_id):
         try:
-            app.db.execute('''
+            rows = app.db.execute('''
                 UPDATE Reviews
                 SET upvotes = upvotes + 1
                 WHERE review_id = :review_id
+                RETURNING product_id
             ''', review_id=review_id)
+            for product_id, in rows:
+                invalidate(('reviews', product_id), ('product', product_id))
             return True
         except Exception as e:
             print(str(e))
             return False
         
-    @staticmethod
-    def get_reviews_by_product(product_id, limit=10):
-        rows = app.db.execute('''
-            SELECT 
-                r.review_id, r.user_id, r.seller_id, r.reviewer_type, 
-                r.product_id, r.stars, r.review_text, r.time_written, r.upvotes,
-                u.firstname, u.lastname
-            FROM Reviews r
-            JOIN Users u ON r.user_id = u.id
-            WHERE r.product_id = :product_id
-            ORDER BY r.time_written DESC
-            LIMIT :limit
-    ''', product_id=product_id, limit=limit)
-        return [Reviews(*row) for row in rows]
-
     @staticmethod
     def get_review_by_user_and_product(user_id, product_id):
         # Execute a query to check if a review exists for the given user and product
@@ -142,22 +142,17 @@ class Reviews:
     @staticmethod
     def get_reviews_by_seller(seller_id, limit=10):
         rows = app.db.execute('''
-            SELECT review_id, user_id, reviewer_type, product_id, stars, review_text, time_written, upvotes
+            SELECT review_id, user_id, seller_id, reviewer_type, product_id, stars, review_text,
+                   time_written, upvotes
             FROM Reviews
             WHERE seller_id = :seller_id
             ORDER BY time_written DESC
             LIMIT :limit
         ''', seller_id=seller_id, limit=limit)
-        return [Reviews(*row) for row in rows]
+        return Reviews.from_rows(rows)
     
     @staticmethod
     def get_average_rating(product_id):
-        """Calculate the average rating for a product."""
-        result = app.db.execute('''
-            SELECT COALESCE(AVG(stars), 0) AS average_rating
-            FROM Reviews
-            WHERE product_id = :product_id
-        ''', product_id=product_id)
-    
-        return result[0]['average_rating'] if result else 0
+        """Average rating of a product, from its ProductStats row."""
+        return ProductStats.get(product_id).average_rating
 
@@ -0,0 +1,47 @@
+from flask import current_app as app
+
+
+class SellerOrderStatus:
+    """
+    Each seller's share of each order: the number of its lines, how many of
+    them are fulfilled, their subtotal and the seller's status of the order
+    ('Fulfilled' once every line is; a generated column). create() adds the
+    rows of an order at checkout and refresh() recounts a seller's fulfilled
+    lines after their statuses change, both in the transaction that changes
+    CartProducts, so the seller orders dashboard (see
+    Order.get_paginated_seller_orders) reads them straight off an index.
+    """
+
+    @staticmethod
+    def create(order_id):
+        """Adds (or, for an order being created again, recomputes) the rows of
+        order_id's sellers. Call after the order's Orders row is written."""
+        app.db.execute('''
+        INSERT INTO SellerOrderStatus (seller_id, order_id, created_at, line_count,
+                                       fulfilled_count, subtotal)
+        SELECT cp.seller_id, o.order_id, o.created_at, COUNT(*),
+               COUNT(*) FILTER (WHERE cp.fulfillment_status = 'Fulfilled'),
+               SUM(cp.quantity * cp.unit_price)
+        FROM Orders o
+        JOIN CartProducts cp ON cp.order_id = o.order_id
+        WHERE o.order_id = :order_id
+        GROUP BY cp.seller_id, o.order_id, o.created_at
+        ON CONFLICT (seller_id, order_id) DO UPDATE
+        SET created_at = EXCLUDED.created_at,
+            line_count = EXCLUDED.line_count,
+            fulfilled_count = EXCLUDED.fulfilled_count,
+            subtotal = EXCLUDED.subtotal
+        ''', order_id=order_id)
+
+    @staticmethod
+    def refresh(seller_id, *order_ids):
+        """Recounts seller_id's fulfilled lines of order_ids."""
+        app.db.execute('''
+        UPDATE SellerOrderStatus s
+        SET fulfilled_count = c.fulfilled_count
+        FROM (SELECT order_id, COUNT(*) FILTER (WHERE fulfillment_status = 'Fulfilled') AS fulfilled_count
+              FROM CartProducts
+              WHERE order_id = ANY(CAST(:order_ids AS INT[])) AND seller_id = :seller_id
+              GROUP BY order_id) AS c
+        WHERE s.seller_id = :seller_id AND s.order_id = c.order_id
+        ''', seller_id=seller_id, order_ids=list(order_ids))
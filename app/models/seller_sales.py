@@ -0,0 +1,86 @@
+from flask import current_app as app
+from app.models.helpers.jobs import job
+from app.models.helpers.row_model import RowModel
+
+
+class ProductSales(RowModel):
+    """Units of a product sold by a seller."""
+    __slots__ = ()
+    _fields = ('product_id', 'product_name', 'quantity_ordered')
+
+
+class DailySales(RowModel):
+    """A seller's units sold and revenue on one day."""
+    __slots__ = ()
+    _fields = ('sale_date', 'units_sold', 'revenue')
+
+
+class SellerSales:
+    """
+    Rollups of the orders' lines per (seller, product): units sold, revenue,
+    number of orders and the time of the last sale, in total (SellerSales) and
+    per day (SellerSalesDaily). Checkout queues record() for each order, so
+    the rollups trail the orders by as long as the job worker takes, and the
+    seller analytics read a few rows of an index instead of summing every
+    line the seller ever sold.
+    """
+
+    @staticmethod
+    @job('record_sales')
+    def record(order_id):
+        """Adds the lines of order_id to its sellers' rollups (a job queued at
+        checkout; it runs exactly once per order)."""
+        # In key order, so that concurrent jobs of the same sellers do not deadlock
+        app.db.execute('''
+        INSERT INTO SellerSales (seller_id, product_id, units_sold, revenue, order_count, last_sold_at)
+        SELECT cp.seller_id, cp.product_id, cp.quantity, cp.quantity * cp.unit_price, 1, o.created_at
+        FROM Orders o
+        JOIN CartProducts cp ON cp.order_id = o.order_id
+        WHERE o.order_id = :order_id
+        ORDER BY cp.seller_id, cp.product_id
+        ON CONFLICT (seller_id, product_id) DO UPDATE
+        SET units_sold = SellerSales.units_sold + EXCLUDED.units_sold,
+            revenue = SellerSales.revenue + EXCLUDED.revenue,
+            order_count = SellerSales.order_count + 1,
+            last_sold_at = GREATEST(SellerSales.last_sold_at, EXCLUDED.last_sold_at)
+        ''', order_id=order_id)
+        app.db.execute('''
+        INSERT INTO SellerSalesDaily (seller_id, sale_date, product_id, units_sold, revenue)
+        SELECT cp.seller_id, CAST(o.created_at AS DATE), cp.product_id, cp.quantity,
+               cp.quantity * cp.unit_price
+        FROM Orders o
+        JOIN CartProducts cp ON cp.order_id = o.order_id
+        WHERE o.order_id = :order_id
+        ORDER BY cp.seller_id, cp.product_id
+        ON CONFLICT (seller_id, sale_date, product_id) DO UPDATE
+        SET units_sold = SellerSalesDaily.units_sold + EXCLUDED.units_sold,
+            revenue = SellerSalesDaily.revenue + EXCLUDED.revenue
+        ''', order_id=order_id)
+
+    @staticmethod
+    def top(seller_id, limit=3, ascending=False):
+        """The seller's limit best-selling products (worst-selling, if
+        ascending) that sold at all."""
+        direction = 'ASC' if ascending else 'DESC'
+        rows = app.db.execute(f'''
+        SELECT s.product_id, p.product_name, s.units_sold
+        FROM SellerSales s
+        JOIN Products p ON p.product_id = s.product_id AND p.seller_id = s.seller_id
+        WHERE s.seller_id = :seller_id
+        ORDER BY s.units_sold {direction}, s.product_id {direction}
+        LIMIT :limit
+        ''', seller_id=seller_id, limit=limit)
+        return ProductSales.from_rows(rows)
+
+    @staticmethod
+    def daily(seller_id, start_date, end_date):
+        """The seller's units sold and revenue per day from start_date up to
+        and including end_date (days without sales are left out)."""
+        rows = app.db.execute('''
+        SELECT sale_date, SUM(units_sold), SUM(revenue)
+        FROM SellerSalesDaily
+        WHERE seller_id = :seller_id AND sale_date BETWEEN :start_date AND :end_date
+        GROUP BY sale_date
+        ORDER BY sale_date
+        ''', seller_id=seller_id, start_date=start_date, end_date=end_date)
+        return DailySales.from_rows(rows)
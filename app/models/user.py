@@ -1,7 +1,10 @@
 from flask_login import UserMixin
 from flask import current_app as app
 from werkzeug.security import generate_password_hash, check_password_hash
+from app.models.balance_ledger import AVAILABLE_BALANCE, BalanceLedger
 from app.models.cart_items import CartItems
+from app.models.helpers.db_pool import use_pool
+from app.models.helpers.db_exceptions_wrapper import retry_transaction
 
 from .. import login
 
@@ -18,9 +21,9 @@ class User(UserMixin):
 
     @staticmethod
     def get_by_auth(email, password):
-        rows = app.db.execute("""
-SELECT password, id, email, firstname, lastname, balance, seller, address
-FROM Users
+        rows = app.db.execute(f"""
+SELECT password, id, email, firstname, lastname, {AVAILABLE_BALANCE}, seller, address
+FROM Users u
 WHERE email = :email
 """,
                               email=email)
@@ -65,9 +68,9 @@ RETURNING id
     @staticmethod
     @login.user_loader
     def get(id):
-        rows = app.db.execute("""
-        SELECT id, email, firstname, lastname, balance, seller, address
-        FROM Users
+        rows = app.db.execute(f"""
+        SELECT id, email, firstname, lastname, {AVAILABLE_BALANCE}, seller, address
+        FROM Users u
         WHERE id = :id
         """, id=id)
         
@@ -82,9 +85,9 @@ RETURNING id
     @staticmethod
     def get_balance(uid):
         bal = app.db.execute(
-            """
-            SELECT balance
-            FROM Users
+            f"""
+            SELECT {AVAILABLE_BALANCE}
+            FROM Users u
             WHERE id = :uid
             """,
             uid=uid,
@@ -104,16 +107,27 @@ RETURNING id
         return addr[0][0] if addr else 0
     
     @staticmethod
-    def update_balance(uid, amount):
-        app.db.execute(
-            """
-            UPDATE Users
-            SET balance = balance + :amount
-            WHERE id = :uid
-            """,
-            uid=uid,
-            amount=amount
-        )
+    @retry_transaction
+    @use_pool('checkout')
+    def update_balance(uid, amount, reason=None, order_id=None):
+        """
+        Records a change of amount (negative for a debit) to the user's balance
+        in the ledger. A debit is only recorded if the balance covers it: the
+        check runs under the Users row lock, which every debit takes, so
+        concurrent debits cannot overdraw. Returns False if it did not.
+        """
+        if amount < 0:
+            rows = app.db.execute(
+                """
+                SELECT 1 FROM Users WHERE id = :uid FOR UPDATE
+                """,
+                uid=uid
+            )
+            # Read after the lock is granted, in a statement of its own
+            if not rows or User.get_balance(uid) < -amount:
+                return False
+        BalanceLedger.add(uid, amount, reason or ('withdrawal' if amount < 0 else 'deposit'), order_id)
+        return True
         
     @staticmethod
     def update_info(uid, email, password, firstname, lastname, address):
@@ -154,6 +168,7 @@ RETURNING id
             
             
     @staticmethod
+    @use_pool('analytics')
     def average_spent(uid):
         # Import here to remove circular Import
         from app.models.orders import Order 
@@ -177,6 +192,7 @@ RETURNING id
         return round(average, 2)
     
     @staticmethod
+    @use_pool('analytics')
     def max_order_price(uid):
         result = app.db.execute(
             """
@@ -189,6 +205,7 @@ RETURNING id
         return result[0][0] if result else 0
     
     @staticmethod
+    @use_pool('analytics')
     def min_order_price(uid):
         result = app.db.execute(
             """
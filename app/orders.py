@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash
 from flask_login import login_required, current_user
-from app.models.orders import Order
+from app.export import export_response, parse_date_range
+from app.models.orders import Order, BUYER_EXPORT_COLUMNS
 
 bp = Blueprint('orders', __name__)
 
@@ -37,3 +38,20 @@ def order_details(order_id):
         page=page,
         total_pages=total_pages
     )
+
+
+@bp.route('/view_orders/export')
+@login_required
+def export_orders():
+    """Downloads the items of the user's orders, optionally those created
+    between the start and end dates, as CSV or NDJSON (format=ndjson)."""
+    user_id = current_user.id
+    try:
+        start, end = parse_date_range(request.args)
+    except ValueError as e:
+        flash(f"Invalid date range: {e}", "error")
+        return redirect(url_for('users.user_home'))
+
+    rows = Order.stream_buyer_lines(user_id, start, end)
+    return export_response(BUYER_EXPORT_COLUMNS, rows, request.args.get('format'),
+                           f"orders-{user_id}")
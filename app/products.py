@@ -1,27 +1,26 @@
 from flask import render_template, request, Blueprint
-from flask_login import current_user
 from .models.product import Product
-from .models.inventory_items import InventoryItems 
-from .models.reviews import Reviews  
+from .models.product_page import ProductPage
 import datetime
 
 bp = Blueprint('products', __name__)
 
 @bp.route('/product/<int:product_id>', methods=['GET'])
 def product_detail(product_id):
-    product = Product.get(product_id)    # Fetch product details
-    sellers = InventoryItems.get_all_by_product(product_id)   # Fetch sellers for this product
-    reviews = Reviews.get_reviews_by_product(product_id)  # Fetch reviews for this product
-    seller_id = current_user.id
+    # Product, sellers, reviews and rating summary in one query, showing the
+    # best (cheapest in-stock) offer
+    page = ProductPage.load(product_id)
+    seller_id = page.product.seller_id if page.product else None
 
 
     return render_template(
         'product_detail.html',
-        product=product,
-        sellers=sellers,
-        seller = sellers[0] if sellers else None,
+        product=page.product,
+        sellers=page.sellers,
+        seller=page.seller,
         seller_id=seller_id,
-        reviews=reviews
+        reviews=page.reviews,
+        stats=page.stats
     )
 
 
@@ -29,29 +28,23 @@ def product_detail(product_id):
 @bp.route('/product/<int:product_id>/seller/<int:seller_id>', methods=['GET'])
 def seller_detail(product_id, seller_id):
     
-    # Fetch product details
-    product = Product.get(product_id)
-
-    # Fetch the selected seller's inventory details
-    seller_info = InventoryItems.get_detailed_inventory_item(seller_id, product_id)
-
-    print(f"Seller info fetched: {seller_info.__dict__ if seller_info else 'None'}")
-
-
-    # Fetch all sellers for the dropdown, to show alternative sellers for this product
-    sellers = InventoryItems.get_all_by_product(product_id)
+    # Fetch the product, the selected seller's inventory details, all sellers
+    # for the dropdown (to show alternative sellers for this product), reviews
+    # and the rating summary in one query
+    page = ProductPage.load(product_id, seller_id)
+    seller_info = page.seller
 
     # Fetch reviews specific to this seller (use real logic when reviews are ready)
     #reviews = Reviews.get_reviews_by_seller(product_id, seller_id) if hasattr(Reviews, 'get_reviews_by_seller') else []
-    reviews = Reviews.get_reviews_by_product(product_id)
 
     return render_template(
         'product_detail.html',
-        product=product,
-        sellers=sellers,
+        product=page.product,
+        sellers=page.sellers,
         seller=seller_info,
         seller_id=seller_id, # pass the current seller information to the template
-        reviews=reviews
+        reviews=page.reviews,
+        stats=page.stats
     )
 
 @bp.route('/search_by_price', methods=['GET', 'POST'])
@@ -0,0 +1,51 @@
+import re
+from collections import Counter
+from functools import lru_cache
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sqlstr):
+    """
+    Normalizes a SQL statement so that statements differing only in literals
+    or whitespace compare equal. Bound :params are already placeholders;
+    literals pasted into f-string queries are replaced with '?'.
+    """
+    sql = _STRING_LITERAL.sub('?', sqlstr)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _IN_LIST.sub('IN (?)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def redact(params):
+    """Returns params with anything that looks like a secret masked, for logging."""
+    return {k: ('***' if 'password' in k.lower() else v) for k, v in params.items()}
+
+
+class QueryStats:
+    """
+    The statements one request ran: fingerprint, duration (seconds) and rows
+    returned or affected, in execution order.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.counts = Counter()
+
+    def record(self, sqlstr, duration, rows):
+        """Records a statement and returns how often its fingerprint has run in this request."""
+        key = fingerprint(sqlstr)
+        self.queries.append((key, duration, rows))
+        self.counts[key] += 1
+        return self.counts[key]
+
+    @property
+    def total_time(self):
+        return sum(duration for _, duration, _ in self.queries)
+
+    def summary(self):
+        return f"queries={len(self.queries)} time_ms={self.total_time * 1000:.1f} distinct={len(self.counts)}"
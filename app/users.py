@@ -91,20 +91,18 @@ def user_home():
 
 @bp.route('/update_balance',  methods=['GET', 'POST'])
 def update_balance():
-    current_balance = float(User.get_balance(current_user.id))
     
     if request.method == 'POST':
         amt = float(request.form['amount'])
         action = request.form['action'] 
         
         if action == "withdraw":
-            if amt <= current_balance:
-                amt = amt * -1
-            else:
-                return render_template('update_balance.html', 
-                                       error="Trying to withdraw amount greater than balance.")
-            
-        User.update_balance(current_user.id, amt)
+            amt = amt * -1
+
+        # A withdrawal is checked against the balance as part of recording it
+        if not User.update_balance(current_user.id, amt):
+            return render_template('update_balance.html', 
+                                   error="Trying to withdraw amount greater than balance.")
         return redirect(url_for('users.update_balance'))
   
     return render_template('update_balance.html')
@@ -185,8 +183,8 @@ def user_purchase_analytics(uid):
     orders = Order.get_all_orders(uid)
     
     # Step 2: Prepare data for the bar chart
-    purchase_dates = [order['created_at'] for order in orders]
-    total_prices = [order['total_price'] for order in orders]
+    purchase_dates = [order.created_at for order in orders]
+    total_prices = [order.total_price for order in orders]
     
     # Step 3: Create the bar chart in memory
     fig, ax = plt.subplots(figsize=(10, 6))
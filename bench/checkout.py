@@ -0,0 +1,312 @@
+"""
+Concurrent checkout benchmark.
+
+Drives N buyers, one thread each, through add-to-cart and checkout against
+the app and the database configured by the DB_* environment variables, with
+a configurable share of the cart lines on a few hot offers. Prints (or
+writes to --output) a JSON report of throughput, latency percentiles,
+outcomes, serialization-failure and retry rates, and consistency checks
+(no offer sold beyond its stock, no negative balance), so runs can be
+compared across changes. Exits with status 1 if a check fails.
+
+Run it from the repository root, on a database you can throw away:
+
+    python -m bench.checkout --seed --buyers 100 --hot-skus 3 --hot-share 0.8
+
+--seed (re)creates the database from db/generated with db/setup.sh first.
+The buyers' balances, addresses and pending carts are overwritten.
+Follow-up jobs queued by checkout (see app/jobs.py) are not run.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from threading import Barrier, Lock, Thread
+
+from app import create_app
+from app.models.balance_ledger import AVAILABLE_BALANCE
+from app.models.product_offers import ProductOffers
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUCCESS = 'Your purchase was completed successfully!'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Concurrent checkout benchmark.')
+    parser.add_argument('--seed', action='store_true',
+                        help='(re)create the database from db/generated first')
+    parser.add_argument('--buyers', type=int, default=50, help='concurrent buyers')
+    parser.add_argument('--rounds', type=int, default=5, help='checkouts per buyer')
+    parser.add_argument('--lines', type=int, default=2, help='cart lines per checkout')
+    parser.add_argument('--quantity', type=int, default=1, help='units per cart line')
+    parser.add_argument('--hot-skus', type=int, default=3, help='number of hot offers')
+    parser.add_argument('--hot-share', type=float, default=0.8,
+                        help='share of cart lines on the hot offers')
+    parser.add_argument('--hot-stock', type=int,
+                        help='reset the stock of each hot offer to this (default: leave it)')
+    parser.add_argument('--balance', type=float, default=1000000,
+                        help="buyers' starting balance")
+    parser.add_argument('--random-seed', type=int, default=316)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    return parser.parse_args(argv)
+
+
+def seed_database():
+    subprocess.run([os.path.join(ROOT, 'db', 'setup.sh'), 'generated'], check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+def percentiles(samples):
+    """Summarizes latencies (in seconds) in milliseconds, nearest-rank."""
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+
+    def rank(p):
+        return samples[max(0, -(-len(samples) * p // 100) - 1)] * 1000
+
+    return {
+        'count': len(samples),
+        'mean': round(sum(samples) / len(samples) * 1000, 2),
+        'p50': round(rank(50), 2),
+        'p95': round(rank(95), 2),
+        'p99': round(rank(99), 2),
+        'max': round(samples[-1] * 1000, 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Benchmark:
+
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.rng = random.Random(args.random_seed)
+        self.latencies = {'add_to_cart': [], 'checkout': []}
+        self.outcomes = {'add_to_cart': Counter(), 'checkout': Counter()}
+        self._lock = Lock()
+
+    def prepare(self):
+        """Picks the buyers and the hot and cold offers, resets the buyers,
+        and records the state the checks compare against."""
+        args = self.args
+        db = self.app.db
+        with self.app.app_context():
+            self.buyers = [r[0] for r in db.execute('''
+            SELECT id FROM Users ORDER BY id LIMIT :n
+            ''', n=args.buyers)]
+            if len(self.buyers) < args.buyers:
+                raise SystemExit(f"Only {len(self.buyers)} users to act as buyers")
+            offers = [tuple(r) for r in db.execute('''
+            SELECT product_id, seller_id
+            FROM Products
+            WHERE available AND product_quantity > 0
+            ORDER BY product_id, seller_id
+            ''')]
+            if len(offers) <= args.hot_skus:
+                raise SystemExit(f"Only {len(offers)} offers in stock")
+            self.rng.shuffle(offers)
+            self.hot, self.cold = offers[:args.hot_skus], offers[args.hot_skus:]
+
+            with db.unit_of_work():
+                db.execute('''
+                DELETE FROM Cart
+                WHERE user_id = ANY(CAST(:buyers AS INT[])) AND purchase_status = 'Pending'
+                ''', buyers=self.buyers)
+                db.execute('''
+                UPDATE Users
+                SET balance = :balance - COALESCE((SELECT SUM(l.amount) FROM BalanceLedger l
+                                                   WHERE l.user_id = Users.id AND NOT l.folded), 0),
+                    address = COALESCE(NULLIF(TRIM(address), ''), '1 Benchmark Way')
+                WHERE id = ANY(CAST(:buyers AS INT[]))
+                ''', balance=args.balance, buyers=self.buyers)
+                if args.hot_stock is not None:
+                    for product_id, seller_id in self.hot:
+                        db.execute('''
+                        UPDATE Products SET product_quantity = :stock
+                        WHERE product_id = :product_id AND seller_id = :seller_id
+                        ''', stock=args.hot_stock, product_id=product_id, seller_id=seller_id)
+                    ProductOffers.refresh(*(product_id for product_id, _ in self.hot))
+                db.commit()
+
+            self.stock_before = self._stock()
+            self.last_order_id = db.execute('SELECT COALESCE(MAX(order_id), 0) FROM Cart')[0][0]
+
+    def run(self):
+        """Runs every buyer to completion; returns the wall-clock time taken."""
+        start = Barrier(len(self.buyers) + 1)
+        threads = [Thread(target=self._buyer, args=(uid, start), daemon=True) for uid in self.buyers]
+        for t in threads:
+            t.start()
+        stats_before = Counter(self.app.db.stats)
+        start.wait()
+        began = time.perf_counter()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - began
+        self.stats = Counter(self.app.db.stats)
+        self.stats.subtract(stats_before)
+        return elapsed
+
+    def _buyer(self, uid, start):
+        args = self.args
+        rng = random.Random(args.random_seed * 1000003 + uid)
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(uid)
+            session['_fresh'] = True
+        start.wait()
+        for _ in range(args.rounds):
+            added = 0
+            for _ in range(args.lines):
+                pool = self.hot if rng.random() < args.hot_share else self.cold
+                product_id, seller_id = rng.choice(pool)
+                outcome = self._request(client, 'add_to_cart', '/add_to_cart', data={
+                    'product_id': product_id, 'seller_id': seller_id, 'quantity': args.quantity})
+                added += outcome == 'Item successfully added to cart!'
+            if not added:
+                self._record('checkout', 'skipped: nothing added', None)
+                continue
+            outcome = self._request(client, 'checkout', '/submit_cart',
+                                    headers={'Idempotency-Key': uuid.uuid4().hex})
+            if outcome != SUCCESS:
+                # Start the next round from an empty cart
+                client.post('/delete_cart')
+                self._flashes(client)
+
+    def _request(self, client, op, path, **kwargs):
+        began = time.perf_counter()
+        try:
+            response = client.post(path, **kwargs)
+            elapsed = time.perf_counter() - began
+            if response.status_code >= 500:
+                outcome = f'error: HTTP {response.status_code}'
+            else:
+                flashes = self._flashes(client)
+                outcome = flashes[-1] if flashes else f'HTTP {response.status_code}'
+        except Exception as e:
+            elapsed = time.perf_counter() - began
+            outcome = f'error: {type(e).__name__}'
+        self._record(op, outcome, elapsed)
+        return outcome
+
+    @staticmethod
+    def _flashes(client):
+        with client.session_transaction() as session:
+            return [message for _, message in session.pop('_flashes', [])]
+
+    def _record(self, op, outcome, elapsed):
+        with self._lock:
+            self.outcomes[op][outcome] += 1
+            if elapsed is not None:
+                self.latencies[op].append(elapsed)
+
+    def _stock(self):
+        return {(r[0], r[1]): r[2] for r in self.app.db.execute('''
+        SELECT product_id, seller_id, product_quantity FROM Products
+        ''')}
+
+    def check(self):
+        """Compares the stock and balances after the run with the orders it
+        completed."""
+        db = self.app.db
+        with self.app.app_context():
+            stock_after = self._stock()
+            sold = {(r[0], r[1]): r[2] for r in db.execute('''
+            SELECT cp.product_id, cp.seller_id, SUM(cp.quantity)
+            FROM CartProducts cp
+            JOIN Cart c ON c.order_id = cp.order_id
+            WHERE c.order_id > :last_order_id AND c.purchase_status = 'Completed'
+            GROUP BY cp.product_id, cp.seller_id
+            ''', last_order_id=self.last_order_id)}
+            completed = db.execute('''
+            SELECT COUNT(*) FROM Cart
+            WHERE order_id > :last_order_id AND purchase_status = 'Completed'
+            ''', last_order_id=self.last_order_id)[0][0]
+            negative_balances = db.execute(f'''
+            SELECT COUNT(*) FROM Users u
+            WHERE u.id = ANY(CAST(:buyers AS INT[])) AND {AVAILABLE_BALANCE} < 0
+            ''', buyers=self.buyers)[0][0]
+        oversold = [[*key, qty] for key, qty in stock_after.items() if qty < 0]
+        mismatched = [[*key, self.stock_before[key], qty, sold.get(key, 0)]
+                      for key, qty in stock_after.items()
+                      if self.stock_before.get(key, qty) - qty != sold.get(key, 0)]
+        observed = self.outcomes['checkout'][SUCCESS]
+        return {
+            'ok': not oversold and not mismatched and not negative_balances and completed == observed,
+            'completed_orders': completed,
+            'oversold_offers': oversold,
+            # [product_id, seller_id, stock before, stock after, units sold]
+            'stock_mismatches': mismatched,
+            'negative_balances': negative_balances,
+        }
+
+    def report(self, elapsed, checks):
+        args = self.args
+        requests = sum(len(v) for v in self.latencies.values())
+        checkouts = self.outcomes['checkout'][SUCCESS]
+        attempts = len(self.latencies['checkout'])
+        retries = self.stats['retries']
+        give_ups = self.stats['retry_give_ups']
+        return {
+            'benchmark': 'checkout',
+            'started_at': self.started_at,
+            'git_commit': git_commit(),
+            'config': {k: v for k, v in vars(args).items() if k not in ('seed', 'output')},
+            'hot_offers': [list(offer) for offer in self.hot],
+            'duration_s': round(elapsed, 3),
+            'throughput': {
+                'requests_per_s': round(requests / elapsed, 2),
+                'checkouts_per_s': round(checkouts / elapsed, 2),
+            },
+            'latency_ms': {op: percentiles(samples) for op, samples in self.latencies.items()},
+            'outcomes': {op: dict(counter.most_common()) for op, counter in self.outcomes.items()},
+            'contention': {
+                # Every retry follows one serialization failure or deadlock, and
+                # so does every give-up (see retry_transaction)
+                'serialization_failures': retries + give_ups,
+                'retries': retries,
+                'retry_give_ups': give_ups,
+                'retries_per_request': round(retries / requests, 4) if requests else 0,
+                'retries_per_checkout': round(retries / attempts, 4) if attempts else 0,
+                'counters': {k: v for k, v in self.stats.items() if v},
+            },
+            'checks': checks,
+        }
+
+    def main(self):
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self.prepare()
+        elapsed = self.run()
+        return self.report(elapsed, self.check())
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.seed:
+        seed_database()
+    report = Benchmark(create_app(), args).main()
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0 if report['checks']['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -19,9 +19,24 @@ CREATE TABLE Users (
     lastname VARCHAR(255) NOT NULL,
     address VARCHAR(255) NOT NULL DEFAULT ' ',
     seller BOOLEAN DEFAULT FALSE,
+    -- Balance as of the last compaction of BalanceLedger; the available
+    -- balance adds the entries not folded yet (see app/models/balance_ledger.py)
     balance DECIMAL(12,2) DEFAULT 0
 );
 
+-- Append-only record of balance changes (positive credits, negative debits)
+CREATE TABLE BalanceLedger (
+    entry_id BIGINT NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+    user_id INT NOT NULL REFERENCES Users(id),
+    amount DECIMAL(12,2) NOT NULL,
+    reason VARCHAR(50) NOT NULL,
+    order_id INT,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (current_timestamp AT TIME ZONE 'UTC'),
+    folded BOOLEAN NOT NULL DEFAULT FALSE
+);
+CREATE INDEX balanceledger_unfolded_idx ON BalanceLedger (user_id) INCLUDE (amount) WHERE NOT folded;
+CREATE INDEX balanceledger_user_idx ON BalanceLedger (user_id, entry_id);
+
 CREATE TABLE Products (
     product_id INT NOT NULL,
     product_name VARCHAR(255) NOT NULL,
@@ -32,8 +47,32 @@ CREATE TABLE Products (
     description TEXT,
     image VARCHAR(255),
     category product_category NOT NULL,
+    -- Full-text search document: name matches rank above description matches
+    search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(product_name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED,
     PRIMARY KEY (product_id, seller_id)
 );
+CREATE INDEX products_search_idx ON Products USING GIN (search_vector);
+
+-- Per-product summary of the sellers' offers, maintained by every Products
+-- write (app/models/product_offers.py); every product_id has a row. The
+-- catalog lists the products with an in-stock best offer, one row each
+CREATE TABLE ProductOffers (
+    product_id INT NOT NULL PRIMARY KEY,
+    seller_count INT NOT NULL DEFAULT 0,
+    total_quantity INT NOT NULL DEFAULT 0,
+    min_price DECIMAL(12,2),
+    max_price DECIMAL(12,2),
+    best_seller_id INT,
+    best_price DECIMAL(12,2),
+    category product_category,
+    FOREIGN KEY (product_id, best_seller_id) REFERENCES Products(product_id, seller_id)
+);
+-- Keyset pagination and price filters of the catalog (see app/index.py)
+CREATE INDEX productoffers_price_idx ON ProductOffers (best_price, product_id)
+    WHERE best_seller_id IS NOT NULL;
 
 CREATE TABLE Cart (
     order_id INT PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
@@ -43,6 +82,8 @@ CREATE TABLE Cart (
     purchase_status VARCHAR(50) NOT NULL DEFAULT 'Pending',
     coupon_code VARCHAR(50)
 );
+-- A user has at most one pending cart
+CREATE UNIQUE INDEX cart_pending_idx ON Cart (user_id) WHERE purchase_status = 'Pending';
 
 CREATE TABLE CartProducts (
     order_id INT NOT NULL REFERENCES Cart(order_id) ON DELETE CASCADE,
@@ -55,6 +96,32 @@ CREATE TABLE CartProducts (
     FOREIGN KEY (product_id, seller_id) REFERENCES Products(product_id, seller_id)
 );
 
+-- Stock held by cart lines until expires_at (see app/models/inventory_holds.py);
+-- a cart may take product_quantity minus the unexpired holds of other carts
+CREATE TABLE InventoryHolds (
+    order_id INT NOT NULL,
+    product_id INT NOT NULL,
+    seller_id INT NOT NULL,
+    quantity INT NOT NULL CHECK (quantity > 0),
+    expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (order_id, product_id, seller_id),
+    FOREIGN KEY (order_id, product_id, seller_id)
+        REFERENCES CartProducts(order_id, product_id, seller_id) ON DELETE CASCADE
+);
+CREATE INDEX inventoryholds_offer_idx ON InventoryHolds (product_id, seller_id, expires_at);
+CREATE INDEX inventoryholds_expires_idx ON InventoryHolds (expires_at);
+
+
+-- Outcomes of checkout submissions by idempotency key, so that a repeated
+-- submission returns the stored result instead of checking out again
+-- (see CartSubmission.submit_cart)
+CREATE TABLE CheckoutRequests (
+    user_id INT NOT NULL REFERENCES Users(id),
+    idempotency_key VARCHAR(64) NOT NULL,
+    result TEXT NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (current_timestamp AT TIME ZONE 'UTC'),
+    PRIMARY KEY (user_id, idempotency_key)
+);
 
 CREATE TABLE Coupons (
     coupon_code VARCHAR(50) PRIMARY KEY,
@@ -70,7 +137,55 @@ CREATE TABLE Orders (
     coupon_code VARCHAR(50),
     FOREIGN KEY (user_id) REFERENCES Users(id)
 );
+-- A buyer's orders by date (order history and its export)
+CREATE INDEX orders_user_idx ON Orders (user_id, created_at, order_id);
+
+
+-- Each seller's share of each order: its lines, how many of them are
+-- fulfilled and their subtotal (see app/models/seller_order_status.py), kept
+-- in step with CartProducts by checkout and fulfillment updates, so the
+-- seller orders dashboard reads a range of an index instead of regrouping
+-- every line the seller ever sold
+CREATE TABLE SellerOrderStatus (
+    seller_id INT NOT NULL REFERENCES Users(id),
+    order_id INT NOT NULL REFERENCES Orders(order_id),
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    line_count INT NOT NULL,
+    fulfilled_count INT NOT NULL DEFAULT 0,
+    subtotal DECIMAL(12,2) NOT NULL,
+    status VARCHAR(50) GENERATED ALWAYS AS
+        (CASE WHEN fulfilled_count = line_count THEN 'Fulfilled' ELSE 'Incomplete' END) STORED,
+    PRIMARY KEY (seller_id, order_id)
+);
+CREATE INDEX sellerorderstatus_status_idx
+    ON SellerOrderStatus (seller_id, status, created_at DESC, order_id DESC);
+
+-- Units sold and revenue per seller and product, in total and per day
+-- (of Orders.created_at), added to by a job queued at checkout (see
+-- app/models/seller_sales.py), so seller analytics do not rescan the
+-- order history
+CREATE TABLE SellerSales (
+    seller_id INT NOT NULL REFERENCES Users(id),
+    product_id INT NOT NULL,
+    units_sold INT NOT NULL,
+    revenue DECIMAL(14,2) NOT NULL,
+    order_count INT NOT NULL,
+    last_sold_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (seller_id, product_id),
+    FOREIGN KEY (product_id, seller_id) REFERENCES Products(product_id, seller_id)
+);
+-- Top and bottom sellers, read from either end
+CREATE INDEX sellersales_units_idx ON SellerSales (seller_id, units_sold, product_id);
 
+CREATE TABLE SellerSalesDaily (
+    seller_id INT NOT NULL REFERENCES Users(id),
+    sale_date DATE NOT NULL,
+    product_id INT NOT NULL,
+    units_sold INT NOT NULL,
+    revenue DECIMAL(14,2) NOT NULL,
+    PRIMARY KEY (seller_id, sale_date, product_id),
+    FOREIGN KEY (product_id, seller_id) REFERENCES Products(product_id, seller_id)
+);
 
 CREATE TABLE Reviews (
     review_id INT NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
@@ -84,3 +199,36 @@ CREATE TABLE Reviews (
     upvotes INT NOT NULL DEFAULT 0,
     FOREIGN KEY (product_id, seller_id) REFERENCES Products(product_id, seller_id)
 );
+
+-- Review aggregates per product, maintained by the Reviews write methods
+-- (app/models/product_stats.py); every product_id has a row
+CREATE TABLE ProductStats (
+    product_id INT NOT NULL PRIMARY KEY,
+    review_count INT NOT NULL DEFAULT 0,
+    stars_sum INT NOT NULL DEFAULT 0,
+    stars_1 INT NOT NULL DEFAULT 0,
+    stars_2 INT NOT NULL DEFAULT 0,
+    stars_3 INT NOT NULL DEFAULT 0,
+    stars_4 INT NOT NULL DEFAULT 0,
+    stars_5 INT NOT NULL DEFAULT 0,
+    average_rating DECIMAL(2,1) GENERATED ALWAYS AS (
+        CASE WHEN review_count = 0 THEN 0 ELSE ROUND(stars_sum::DECIMAL / review_count, 1) END
+    ) STORED
+);
+CREATE INDEX productstats_rating_idx ON ProductStats (average_rating, product_id);
+
+-- Durable queue of follow-up work, run by worker.py (see app/jobs.py).
+-- Runnable jobs are queued ones, and running ones whose lease (run_at) has
+-- expired because their worker died; a job's row is deleted once it succeeds
+-- and kept as 'dead' after JOB_MAX_ATTEMPTS failures
+CREATE TABLE Jobs (
+    job_id BIGINT NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+    kind VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}',
+    status VARCHAR(20) NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'dead')),
+    attempts INT NOT NULL DEFAULT 0,
+    run_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (current_timestamp AT TIME ZONE 'UTC'),
+    last_error TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (current_timestamp AT TIME ZONE 'UTC')
+);
+CREATE INDEX jobs_runnable_idx ON Jobs (run_at, job_id) WHERE status IN ('queued', 'running');
@@ -26,3 +26,50 @@ SELECT pg_catalog.setval('public.cart_order_id_seq',
 
 \COPY Orders FROM 'Orders.csv' WITH DELIMITER ',' NULL '' CSV;
 
+
+-- Derived tables, rebuilt from the data loaded above:
+INSERT INTO ProductStats (product_id, review_count, stars_sum,
+                          stars_1, stars_2, stars_3, stars_4, stars_5)
+SELECT ids.product_id, COUNT(r.stars), COALESCE(SUM(r.stars), 0),
+       COUNT(*) FILTER (WHERE r.stars = 1), COUNT(*) FILTER (WHERE r.stars = 2),
+       COUNT(*) FILTER (WHERE r.stars = 3), COUNT(*) FILTER (WHERE r.stars = 4),
+       COUNT(*) FILTER (WHERE r.stars = 5)
+FROM (SELECT DISTINCT product_id FROM Products) AS ids
+LEFT JOIN Reviews r ON r.product_id = ids.product_id
+GROUP BY ids.product_id;
+
+INSERT INTO ProductOffers (product_id, seller_count, total_quantity, min_price, max_price,
+                           best_seller_id, best_price, category)
+SELECT ids.product_id, COUNT(p.seller_id), COALESCE(SUM(p.product_quantity), 0),
+       MIN(p.price), MAX(p.price), best.seller_id, best.price, best.category
+FROM (SELECT DISTINCT product_id FROM Products) AS ids
+LEFT JOIN Products p ON p.product_id = ids.product_id AND p.available
+LEFT JOIN LATERAL (
+    SELECT b.seller_id, b.price, b.category
+    FROM Products b
+    WHERE b.product_id = ids.product_id AND b.available AND b.product_quantity > 0
+    ORDER BY b.price, b.seller_id
+    LIMIT 1
+) best ON TRUE
+GROUP BY ids.product_id, best.seller_id, best.price, best.category;
+
+INSERT INTO SellerOrderStatus (seller_id, order_id, created_at, line_count, fulfilled_count, subtotal)
+SELECT cp.seller_id, o.order_id, o.created_at, COUNT(*),
+       COUNT(*) FILTER (WHERE cp.fulfillment_status = 'Fulfilled'), SUM(cp.quantity * cp.unit_price)
+FROM Orders o
+JOIN CartProducts cp ON cp.order_id = o.order_id
+GROUP BY cp.seller_id, o.order_id, o.created_at;
+
+INSERT INTO SellerSales (seller_id, product_id, units_sold, revenue, order_count, last_sold_at)
+SELECT cp.seller_id, cp.product_id, SUM(cp.quantity), SUM(cp.quantity * cp.unit_price),
+       COUNT(*), MAX(o.created_at)
+FROM Orders o
+JOIN CartProducts cp ON cp.order_id = o.order_id
+GROUP BY cp.seller_id, cp.product_id;
+
+INSERT INTO SellerSalesDaily (seller_id, sale_date, product_id, units_sold, revenue)
+SELECT cp.seller_id, CAST(o.created_at AS DATE), cp.product_id, SUM(cp.quantity),
+       SUM(cp.quantity * cp.unit_price)
+FROM Orders o
+JOIN CartProducts cp ON cp.order_id = o.order_id
+GROUP BY cp.seller_id, CAST(o.created_at AS DATE), cp.product_id;
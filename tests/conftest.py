@@ -0,0 +1,21 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+from app import create_app
+
+
+@pytest.fixture(scope='session')
+def app():
+    """The app, on the database configured by the DB_* environment variables;
+    tests that use it are skipped when that database is not reachable."""
+    app = create_app()
+    try:
+        with app.app_context():
+            app.db.execute('SELECT 1')
+    except OperationalError as e:
+        pytest.skip(f"Database not available: {e}")
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,43 @@
+import pytest
+from app.models.helpers.cache import cached, invalidate
+
+reads = []
+
+
+@cached(lambda key: ('test', key))
+def read(key):
+    reads.append(key)
+    return len(reads)
+
+
+@pytest.fixture
+def unit_of_work(app):
+    reads.clear()
+    with app.app_context(), app.db.unit_of_work():
+        yield app.db
+
+
+def test_reads_bypass_the_cache_after_an_invalidation(unit_of_work):
+    assert read(1) == read(1) == 1
+    invalidate(('test', 2))
+    # Could see the unit of work's uncommitted writes; not to be shared
+    assert read(1) == 2
+    assert read(1) == 3
+    unit_of_work.commit()
+    assert read(3) == read(3) == 4
+
+
+def test_rollback_drops_the_invalidated_entries(unit_of_work):
+    invalidate(('test', 1))
+    assert read(1) == 1
+    unit_of_work.rollback()
+    # Nothing was cached while the invalidation was pending
+    assert read(1) == read(1) == 2
+
+
+def test_rollback_drops_entries_cached_in_the_meantime(app, unit_of_work):
+    invalidate(('test', 1))
+    # A concurrent request caching the rows as they were
+    app.cache.get_or_set((('test', 1), read.__qualname__, (1,), ()), lambda: 'stale')
+    unit_of_work.rollback()
+    assert read(1) == 1
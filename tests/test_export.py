@@ -0,0 +1,31 @@
+import pytest
+
+
+@pytest.fixture
+def seller(client):
+    with client.session_transaction() as session:
+        session['_user_id'] = '10'
+        session['_fresh'] = True
+    return client
+
+
+def test_export_releases_its_slot_when_the_download_ends(app, seller):
+    # More downloads one after another than there are slots
+    for _ in range(app.config['DB_POOLS']['export']['pool_size'] + 1):
+        response = seller.get('/orders_dashboard/export')
+        assert response.status_code == 200
+        assert response.get_data(as_text=True).startswith('order_id,created_at,')
+        response.close()
+
+
+def test_export_is_turned_away_when_every_slot_is_taken(app, seller):
+    slots = app.config['DB_POOLS']['export']['pool_size']
+    for _ in range(slots):
+        assert app.export_slots.acquire(blocking=False)
+    try:
+        response = seller.get('/orders_dashboard/export?format=ndjson')
+        assert response.status_code == 429
+        assert response.headers['Retry-After']
+    finally:
+        for _ in range(slots):
+            app.export_slots.release()
@@ -0,0 +1,16 @@
+import re
+
+
+def test_unfiltered_catalog_total_is_close_to_its_size(app, client):
+    with app.app_context():
+        app.db.execute('ANALYZE ProductOffers')
+        size = app.db.execute('''
+        SELECT COUNT(*) FROM ProductOffers o WHERE o.best_seller_id IS NOT NULL
+        ''')[0][0]
+
+    page = client.get('/').get_data(as_text=True)
+    total_pages = int(re.search(r'Page 1 of about (\d+)', page).group(1))
+
+    per_page = 9
+    expected = (size + per_page - 1) // per_page
+    assert abs(total_pages - expected) <= max(2, expected // 10)
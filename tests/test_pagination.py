@@ -0,0 +1,43 @@
+import base64
+import json
+from decimal import Decimal
+
+import pytest
+
+from app.index import KEYSETS
+from app.models.helpers.pagination import decode_cursor, encode_cursor
+
+
+def tamper(data):
+    raw = json.dumps(data).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def test_cursor_round_trip_converts_values_to_column_types():
+    token = encode_cursor('price_asc', [Decimal('19.99'), 42], 3)
+    assert decode_cursor(token, 'price_asc', KEYSETS['price_asc']) == ([Decimal('19.99'), 42], 3, False)
+
+
+@pytest.mark.parametrize('sort, data', [
+    ('id', {'s': 'id', 'k': ['abc'], 'p': 2}),
+    ('id', {'s': 'id', 'k': [{'x': 1}], 'p': 2}),
+    ('id', {'s': 'id', 'k': [[1]], 'p': 2}),
+    ('id', {'s': 'id', 'k': [True], 'p': 2}),
+    ('id', {'s': 'id', 'k': [2 ** 40], 'p': 2}),
+    ('id', {'s': 'id', 'k': [], 'p': 2}),
+    ('id', {'s': 'id', 'k': [1, 2], 'p': 2}),
+    ('price_asc', {'s': 'price_asc', 'k': ['NaN', 1], 'p': 2}),
+    ('price_asc', {'s': 'price_asc', 'k': ['cheap', 1], 'p': 2}),
+    ('price_asc', {'s': 'price_asc', 'k': [1], 'p': 2}),
+    ('id', {'s': 'id', 'k': [1], 'p': 'x'}),
+    ('id', ['id', [1], 2]),
+])
+def test_tampered_cursor_is_rejected(sort, data):
+    assert decode_cursor(tamper(data), sort, KEYSETS[sort]) is None
+
+
+def test_index_falls_back_to_page_one_on_tampered_cursor(client):
+    response = client.get('/', query_string={
+        'sort': 'price_asc', 'cursor': tamper({'s': 'price_asc', 'k': [{'x': 1}, 'abc'], 'p': 5})})
+    assert response.status_code == 200
+    assert 'Page 1 of' in response.get_data(as_text=True)
@@ -0,0 +1,9 @@
+from app import create_app
+from app.jobs import JobWorker
+
+# Runs the follow-up jobs queued by the web app (see app/jobs.py):
+#   python worker.py
+app = create_app()
+
+if __name__ == '__main__':
+    JobWorker(app).run()